@@ -5,12 +5,21 @@ from django.contrib.gis.db import models
 from django import forms
 
 from open511_server.models import (RoadEvent, Jurisdiction,
-    JurisdictionGeography, Area, Camera, ImportTaskStatus)
+    JurisdictionGeography, Area, Camera, ImportTaskStatus, Subscription,
+    SubscriptionDelivery)
+from open511_server.utils.search import search_events
 
 class RoadEventAdmin(admin.ModelAdmin):
     list_display = ['headline', 'full_id', 'severity', 'active', 'has_remaining_periods']
     list_filter = ['jurisdiction', 'active']
-    search_fields = ['xml_data', 'id']
+    search_fields = ['id']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the text search indexes, rather than a LIKE over the XML
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_events(queryset, search_term, rank=False) | queryset.filter(id=search_term), False
 
 
 class JurisdictionAdmin(admin.ModelAdmin):
@@ -22,7 +31,17 @@ class JurisdictionGeographyAdmin(admin.ModelAdmin):
     }
 
 class ImportTaskStatusAdmin(admin.ModelAdmin):
-    list_display = ['id', 'updated', 'admin_num_imported']
+    list_display = ['id', 'updated', 'admin_num_imported', 'admin_interval']
+
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'callback_url', 'jurisdiction', 'active']
+    formfield_overrides = {
+        models.GeometryField: {'widget': forms.widgets.Textarea}
+    }
+
+class SubscriptionDeliveryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subscription', 'change', 'status', 'attempts', 'next_attempt_at']
+    list_filter = ['status', 'subscription']
 
 admin.site.register(RoadEvent, RoadEventAdmin)
 admin.site.register(Jurisdiction, JurisdictionAdmin)
@@ -30,6 +49,8 @@ admin.site.register(JurisdictionGeography, JurisdictionGeographyAdmin)
 admin.site.register(Area)
 admin.site.register(Camera)
 admin.site.register(ImportTaskStatus, ImportTaskStatusAdmin)
+admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(SubscriptionDelivery, SubscriptionDeliveryAdmin)
 
 class JurInline(admin.TabularInline):
     model = Jurisdiction.permitted_users.through
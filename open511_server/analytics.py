@@ -0,0 +1,149 @@
+"""Hourly rollups of road events for historical reports.
+
+EventRollup holds, for each hour, jurisdiction, area, event type and severity,
+how many published events started (were created) and ended (were archived).
+Every event is counted under area ALL_AREAS, and under each of its own areas
+(or '' if it has none), so totals never double-count multi-area events.
+
+update_rollups() keeps them current from the change log: for each event
+changed since its last run, it subtracts what the event previously
+contributed (kept in EventFact) and adds what it contributes now. It's run
+by the update_rollups command, not by requests for the report."""
+
+from collections import defaultdict
+import logging
+
+from django.db import connection, transaction
+
+from open511_server.models import EventChange, EventFact, EventRollup, ImportTaskStatus
+
+logger = logging.getLogger(__name__)
+
+CURSOR_STATUS_ID = 'analytics rollups'
+
+STARTED, ENDED = 0, 1
+
+_FACTS_SQL = """SELECT jur.id || '/' || t.id, jur.id,
+        coalesce((xpath('event_type/text()', t.xml_data))[1]::text, ''),
+        coalesce((xpath('severity/text()', t.xml_data))[1]::text, ''),
+        array_to_string(xpath('areas/area/id/text()', t.xml_data)::text[], ','),
+        t.created,
+        CASE WHEN t.active THEN NULL ELSE
+            (SELECT max(c.created) FROM open511_eventchange c
+                WHERE c.full_id = jur.id || '/' || t.id AND c.change_type = 'ARCHIVED') END,
+        t.active, t.updated
+    FROM open511_roadevent t
+    JOIN open511_jurisdiction jur ON jur.internal_id = t.jurisdiction_id
+    WHERE t.published AND {where}"""
+
+
+def _hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _contributions(fact):
+    """Yields the (bucket, jurisdiction, area_id, event_type, severity) keys an
+    EventFact counts towards, each with STARTED or ENDED."""
+    areas = [EventRollup.ALL_AREAS] + (fact.areas.split(',') if fact.areas else [''])
+    for area_id in areas:
+        yield (_hour(fact.started), fact.jurisdiction, area_id, fact.event_type, fact.severity), STARTED
+        if fact.ended:
+            yield (_hour(fact.ended), fact.jurisdiction, area_id, fact.event_type, fact.severity), ENDED
+
+
+def _load_facts(where, params, old_facts=()):
+    """An archived event ended at its latest ARCHIVED change. One that became
+    inactive some other way (e.g. imported as archived) ended when it was
+    first seen inactive: it keeps the end time in its old fact, if any,
+    rather than moving with updated every time it's saved again."""
+    previous_ends = dict((fact.full_id, fact.ended) for fact in old_facts if fact.ended)
+    with connection.cursor() as cursor:
+        cursor.execute(_FACTS_SQL.format(where=where), params)
+        facts = []
+        for full_id, jurisdiction, event_type, severity, areas, started, ended, active, updated in cursor.fetchall():
+            if ended is None and not active:
+                ended = previous_ends.get(full_id, updated)
+            facts.append(EventFact(full_id=full_id, jurisdiction=jurisdiction, event_type=event_type,
+                severity=severity, areas=areas, started=started, ended=ended))
+        return facts
+
+
+def _apply(old_facts, new_facts):
+    """Replaces old_facts with new_facts, adjusting the rollups by the difference."""
+    deltas = defaultdict(lambda: [0, 0])
+    for sign, facts in ((-1, old_facts), (1, new_facts)):
+        for fact in facts:
+            for key, measure in _contributions(fact):
+                deltas[key][measure] += sign
+    values = [key + tuple(counts) for key, counts in deltas.items() if any(counts)]
+
+    with connection.cursor() as cursor:
+        for i in range(0, len(values), 1000):
+            chunk = values[i:i + 1000]
+            cursor.execute(
+                "INSERT INTO open511_eventrollup "
+                "(bucket, jurisdiction, area_id, event_type, severity, started, ended) VALUES "
+                + ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(chunk)) +
+                " ON CONFLICT (bucket, jurisdiction, area_id, event_type, severity) DO UPDATE SET "
+                "started = open511_eventrollup.started + EXCLUDED.started, "
+                "ended = open511_eventrollup.ended + EXCLUDED.ended",
+                [val for row in chunk for val in row])
+        if values:
+            cursor.execute("DELETE FROM open511_eventrollup WHERE bucket = ANY(%s) "
+                "AND started = 0 AND ended = 0", [list(set(row[0] for row in values))])
+
+    EventFact.objects.filter(full_id__in=[f.full_id for f in old_facts]).delete()
+    EventFact.objects.bulk_create(new_facts)
+
+
+def update_rollups(max_changes=None):
+    """Brings the rollups up to date with the change log. Returns the number
+    of events updated, or None if another process is already updating them."""
+    # Changes are only numbered once they've committed, in commit order, so
+    # none can turn up behind the cursor later
+    EventChange.assign_sequences()
+    with transaction.atomic():
+        ImportTaskStatus.objects.get_or_create(id=CURSOR_STATUS_ID)
+    with transaction.atomic():
+        status = ImportTaskStatus.objects.select_for_update(skip_locked=True).filter(
+            id=CURSOR_STATUS_ID).first()
+        if status is None:
+            return None
+        since = status.status_info.get('last_sequence', 0)
+        changes = EventChange.objects.filter(sequence__gt=since).order_by('sequence')
+        if max_changes:
+            changes = changes[:max_changes]
+        changes = list(changes.values_list('sequence', 'full_id'))
+        if not changes:
+            return 0
+
+        full_ids = list(set(full_id for sequence, full_id in changes))
+        old_facts = list(EventFact.objects.filter(full_id__in=full_ids))
+        new_facts = _load_facts("t.id = ANY(%s) AND jur.id || '/' || t.id = ANY(%s)",
+            [[full_id.partition('/')[2] for full_id in full_ids], full_ids], old_facts)
+        _apply(old_facts, new_facts)
+
+        status.status_info['last_sequence'] = changes[-1][0]
+        status.save()
+    if full_ids:
+        logger.info("Analytics rollups updated for %s events" % len(full_ids))
+    return len(full_ids)
+
+
+def rebuild_rollups(chunk_size=1000):
+    """Recomputes all rollups from scratch. Returns the number of events counted."""
+    with transaction.atomic():
+        status, created = ImportTaskStatus.objects.select_for_update().get_or_create(id=CURSOR_STATUS_ID)
+        EventRollup.objects.all().delete()
+        EventFact.objects.all().delete()
+        last_sequence = EventChange.latest_sequence()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT internal_id FROM open511_roadevent WHERE published ORDER BY internal_id")
+            internal_ids = [row[0] for row in cursor.fetchall()]
+        for i in range(0, len(internal_ids), chunk_size):
+            _apply([], _load_facts('t.internal_id = ANY(%s)', [internal_ids[i:i + chunk_size]]))
+
+        status.status_info['last_sequence'] = last_sequence
+        status.save()
+    return len(internal_ids)
@@ -15,5 +15,27 @@ class Open511Settings(AppConf):
     # of the default settings.LOGGING in the import task runner
     IMPORTER_LOGGING = {}
 
+    # How long, in seconds, vector tiles can be cached by the server and clients
+    TILE_CACHE_SECONDS = 300
+
+    # How processes serving the change stream learn about new changes:
+    # 'listen' uses Postgres LISTEN/NOTIFY, and so sees changes from any process;
+    # 'local' sees only changes made within the same process.
+    CHANGE_STREAM_BACKEND = 'listen'
+    # Seconds between keepalive comments on idle change streams
+    CHANGE_STREAM_KEEPALIVE = 20
+
+    # Whether saving or deleting an auto-label Area relabels existing active
+    # events, once it's committed. If off, run the relabel_areas command instead.
+    RELABEL_ON_AREA_SAVE = True
+
+    # With include_total=1, list responses count the results exactly if the
+    # query planner expects no more than this many; otherwise they report its estimate
+    EXACT_COUNT_THRESHOLD = 10000
+
+    # Languages whose stemming the q= event search applies to the search terms.
+    # Event text in other languages is still found, but only by exact words.
+    SEARCH_LANGUAGES = ('en', 'fr')
+
     class Meta:
         prefix = 'OPEN511'
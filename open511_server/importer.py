@@ -1,3 +1,4 @@
+from collections import Counter
 from copy import deepcopy
 import datetime
 import logging
@@ -16,6 +17,8 @@ import requests
 from open511.utils.serialization import XML_LANG, XML_BASE
 from open511.validator import Open511ValidationError
 from open511_server.models import RoadEvent, ImportTaskStatus
+from open511_server.subscriptions import match_subscriptions_on_commit
+from open511_server.utils.areaindex import get_area_index
 
 
 logger = logging.getLogger(__name__)
@@ -31,6 +34,8 @@ class BaseImporter(object):
         self.persist_status = persist_status
         self.last_run_status = {}
         self.status = {}
+        self.result_counts = Counter()
+        self.area_index = None
 
     @property
     def id(self):
@@ -61,15 +66,44 @@ class BaseImporter(object):
                     created.append(db_obj)
 
         self.post_import(created)
+        self.page_imported()
 
         if self.persist_status:
             self.status['objects_imported'] = len(created)
             self.status['counter'] = self.status.get('counter', 0) + 1
+            self.status['objects_changed'] = self.result_counts['CREATED'] + self.result_counts['UPDATED']
+            self.status['objects_unmodified'] = self.result_counts['UNMODIFIED']
+            if self.opts.get('MIN_INTERVAL') and self.opts.get('MAX_INTERVAL'):
+                self.status['interval'] = self.choose_interval()
             self.last_run_obj.status_info = self.status
             self.last_run_obj.save()
 
         logger.info('Importer {} ran, created {} objects'.format(self.id, len(created)))
 
+    @property
+    def interval(self):
+        """Number of seconds to wait before the next run."""
+        return self.status.get('interval', self.opts.get('INTERVAL', 600))
+
+    def choose_interval(self):
+        """Adapts the polling interval to how often the feed actually changes.
+
+        Runs where nothing changed (no created or updated objects, and no new
+        upstream updated timestamp) stretch the interval by half; runs with changes
+        shrink it in proportion to the share of changed objects. The result is
+        kept between MIN_INTERVAL and MAX_INTERVAL."""
+        previous = self.last_run_status.get('interval', self.opts.get('INTERVAL', 600))
+        changed = self.result_counts['CREATED'] + self.result_counts['UPDATED']
+        total = changed + self.result_counts['UNMODIFIED']
+        upstream_changed = self.status.get('max_updated') != self.last_run_status.get('max_updated')
+
+        if not (changed or upstream_changed):
+            interval = previous * 1.5
+        else:
+            changed_ratio = float(changed) / total if total else 1.0
+            interval = previous * max(0.25, 1 - changed_ratio)
+        return int(min(self.opts['MAX_INTERVAL'], max(self.opts['MIN_INTERVAL'], interval)))
+
     def fetch(self):
         raise NotImplementedError
 
@@ -79,14 +113,19 @@ class BaseImporter(object):
     def post_import(self, imported):
         pass
 
+    def page_imported(self):
+        """Called after each page of input has been saved."""
+        match_subscriptions_on_commit()
+
     def archive_existing(self, imported):
         if not len(imported):
             return
         if len(set(o.jurisdiction_id for o in imported)) != 1:
             return logger.error("Not archiving because events are from different jurisdictions")
         jur = imported[0].jurisdiction
-        updated = self.model.objects.filter(jurisdiction=jur, active=True).exclude(
-            id__in=[o.id for o in imported]).update(active=False)
+        updated = self.model.objects.update_and_record(
+            self.model.objects.filter(jurisdiction=jur, active=True).exclude(id__in=[o.id for o in imported]),
+            'ARCHIVED', active=False)
         if updated:
             logger.info("{} events archived".format(updated))
         return updated
@@ -97,7 +136,15 @@ class BaseImporter(object):
             save_opts['default_language'] = self.default_language
         if self.base_url:
             save_opts['base_url'] = self.base_url
-        obj_created, obj = self.model.objects.update_or_create_from_xml(xml_obj, **save_opts)
+        auto_label = self.opts.get('AUTO_LABEL_AREAS')
+        obj_created, obj = self.model.objects.update_or_create_from_xml(xml_obj,
+            save=not auto_label, **save_opts)
+        if auto_label and obj_created != 'UNMODIFIED':
+            if self.area_index is None:
+                self.area_index = get_area_index()
+            self.area_index.label(obj)
+            obj.save()
+        self.result_counts[obj_created] += 1
         yield obj
 
     def _logging_iterable(self, iterable, step_name, exceptions=(Exception,)):
@@ -112,6 +159,13 @@ class BaseImporter(object):
                     e.__class__.__name__, step_name, e))
 
 class Open511Importer(BaseImporter):
+    """Imports events from another Open511 API.
+
+    Every ACTIVE_UPDATES_EVERY runs, it reconciles the local copy against the
+    set of events that are active upstream, archiving any that have disappeared.
+    If ACTIVE_SET_URL is provided (e.g. http://example.org/api/events/jur.id/active_set/),
+    that's done using the compact active-set listing: only events whose content hash
+    has changed are then fetched, ACTIVE_SET_BATCH_SIZE IDs per request."""
 
     def _fetch_url(self, url):
         resp = requests.get(url, headers={
@@ -121,7 +175,7 @@ class Open511Importer(BaseImporter):
         return etree.fromstring(resp.content)
 
     def fetch(self):
-        next_url, _, query = self.opts['URL'].partition('?')
+        base_url, _, query = self.opts['URL'].partition('?')
         query = dict(parse_qsl(query)) if query else {}
 
         self.active_update = bool(
@@ -130,13 +184,20 @@ class Open511Importer(BaseImporter):
                 self.status.get('counter', 0) % self.opts.get('ACTIVE_UPDATES_EVERY', 500) == 0)
         )
 
+        if self.active_update and self.opts.get('ACTIVE_SET_URL'):
+            for xml_obj in self._fetch_active_set_changes(base_url, query):
+                yield xml_obj
+            return
+
         if not self.active_update:
             query['status'] = 'ALL'
             if self.status.get('max_updated'):
                 query['updated'] = '>=' + self.status['max_updated']
 
-        next_url = next_url + '?' + urlencode(query)
+        for xml_obj in self._fetch_pages(base_url + '?' + urlencode(query)):
+            yield xml_obj
 
+    def _fetch_pages(self, next_url):
         while next_url is not None:
             root = self._fetch_url(next_url)
             assert root.tag == 'open511'
@@ -155,6 +216,7 @@ class Open511Importer(BaseImporter):
 
             for xml_obj in root.xpath('events/event'):
                 yield xml_obj
+            self.page_imported()
 
             next_link = root.xpath('pagination/link[@rel="next"]')
             if next_link:
@@ -162,11 +224,53 @@ class Open511Importer(BaseImporter):
             else:
                 next_url = None
 
+    def _fetch_active_set_changes(self, base_url, query):
+        """Archives local events missing from the upstream active set, and
+        yields the upstream XML for those whose content has changed."""
+        root = self._fetch_url(self.opts['ACTIVE_SET_URL'])
+        assert root.tag == 'open511'
+        self.active_set = dict(
+            (el.findtext('id'), el.findtext('hash')) for el in root.xpath('events/event')
+        )
+        known_hashes = self.status.get('active_set_hashes', {})
+        # Hashes for changed events are only recorded once they've been imported successfully,
+        # in post_import
+        self.status['active_set_hashes'] = dict(
+            (full_id, h) for full_id, h in self.active_set.items() if known_hashes.get(full_id) == h)
+        self.active_set_archived = self._archive_missing_from_active_set()
+
+        changed_ids = sorted(full_id.partition('/')[2] for full_id in self.active_set
+            if full_id not in self.status['active_set_hashes'])
+        batch_size = self.opts.get('ACTIVE_SET_BATCH_SIZE', 100)
+        for i in range(0, len(changed_ids), batch_size):
+            batch_query = dict(query, id=','.join(changed_ids[i:i + batch_size]))
+            for xml_obj in self._fetch_pages(base_url + '?' + urlencode(batch_query)):
+                yield xml_obj
+
+    def _archive_missing_from_active_set(self):
+        if not self.active_set:
+            return
+        jurisdiction_ids = set(full_id.partition('/')[0] for full_id in self.active_set)
+        if len(jurisdiction_ids) != 1:
+            return logger.error("Not archiving because events are from different jurisdictions")
+        updated = self.model.objects.update_and_record(
+            self.model.objects.filter(jurisdiction__id=jurisdiction_ids.pop(), active=True).exclude(
+                id__in=[full_id.partition('/')[2] for full_id in self.active_set]),
+            'ARCHIVED', active=False)
+        if updated:
+            logger.info("{} events archived".format(updated))
+        return updated
+
     def convert(self, input_document):
         yield input_document
 
     def post_import(self, imported):
         if getattr(self, 'active_update', False):
-            updated = self.archive_existing(imported)
+            if getattr(self, 'active_set', None) is not None:
+                for obj in imported:
+                    if obj.full_id in self.active_set:
+                        self.status['active_set_hashes'][obj.full_id] = self.active_set[obj.full_id]
+                updated = self.active_set_archived
+            else:
+                updated = self.archive_existing(imported)
             self.status['last_active_update'] = '{} {}'.format(datetime.datetime.now().isoformat(), updated)
-
@@ -1,28 +1,26 @@
 """
-To be executed in a cron job: find all ACTIVE events which don't have
-any scheduled times in the future and archives them.
+To be executed in a cron job: archives all ACTIVE local events whose
+schedules have ended.
+
+Superseded by the run_transitions command, which applies these changes
+as soon as they're due.
 """
 from __future__ import print_function
 
 from django.core.management.base import BaseCommand
 
 from open511_server.models import RoadEvent
+from open511_server.subscriptions import match_subscriptions_on_commit
 
 
 class Command(BaseCommand):
 
     def handle(self, **options):
 
-        count = 0
-
-        ids_to_deactivate = []
-
-        for rdev in RoadEvent.objects.filter(active=True, jurisdiction__external_url=''):
-            if not rdev.has_remaining_periods():
-                ids_to_deactivate.append(rdev.id)
-
-        if ids_to_deactivate:
-            count = RoadEvent.objects.filter(active=True, id__in=ids_to_deactivate).update(active=False)
+        # In case run_transitions --recompute hasn't been run since upgrading
+        RoadEvent.objects.schedule_unscheduled_archives()
+        count = RoadEvent.objects.apply_due_archives()
 
         if count:
+            match_subscriptions_on_commit()
             print('%s event%s archived' % (count, 's' if count > 1 else ''))
@@ -0,0 +1,31 @@
+"""
+A long-running process that POSTs queued subscription deliveries to
+their webhooks, retrying failures with exponential backoff.
+
+Deliveries are queued by match_subscriptions, which runs after imports
+and API writes commit, and periodically here; see open511_server.subscriptions.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from open511_server.subscriptions import DeliveryWorkerPool, match_subscriptions
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+            help="How many deliveries to make at once.")
+        parser.add_argument('--once', action='store_true',
+            help="Make any deliveries that are due, then exit.")
+        parser.add_argument('--match', action='store_true',
+            help="Match subscriptions against any unmatched changes first.")
+
+    def handle(self, **options):
+        logging.basicConfig()
+
+        if options['match']:
+            match_subscriptions()
+
+        DeliveryWorkerPool(workers=options['workers']).run(once=options['once'])
@@ -9,7 +9,7 @@ except ImportError:
     from urllib.parse import urljoin
 
 from django.core.exceptions import (ValidationError, ImproperlyConfigured)
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
 from lxml import etree
@@ -19,7 +19,8 @@ from open511.utils.serialization import XML_LANG, XML_BASE
 from open511.validator import Open511ValidationError
 
 from open511_server.conf import settings
-from open511_server.models import RoadEvent, Jurisdiction, Camera
+from open511_server.models import RoadEvent, Jurisdiction, Camera, ImportTaskStatus
+from open511_server.subscriptions import match_subscriptions_on_commit
 
 
 logger = logging.getLogger(__name__)
@@ -37,16 +38,50 @@ class Command(BaseCommand):
             help='Set the status of all events in the jurisdiction *not* in the supplied file to ARCHIVED.')
         parser.add_argument('--quiet', action='store_true',
             help="Don't print any messages unless there's an error.")
+        parser.add_argument('--commit-every', type=int, default=0, dest='commit_every',
+            help="Commit after every N imported entries, and record progress so that an "
+            "interrupted import can be resumed. By default, the whole import is one transaction.")
+        parser.add_argument('--commit-per-page', action='store_true', dest='commit_per_page',
+            help="Commit after every page, and record progress so that an interrupted "
+            "import can be resumed.")
+        parser.add_argument('--resume', action='store_true',
+            help="Continue an interrupted --commit-every or --commit-per-page import of the same source.")
 
-    @transaction.atomic
     def handle(self, source, **options):
         logging.basicConfig()
 
+        self.chunked = bool(options['commit_every'] or options['commit_per_page'])
+        if options['resume'] and not self.chunked:
+            raise CommandError("--resume requires --commit-every or --commit-per-page")
+
+        if self.chunked:
+            self.run_import(source, **options)
+        else:
+            with transaction.atomic():
+                self.run_import(source, **options)
+
+    def run_import(self, source, **options):
         source_is_url = bool(re.search(r'^https?://', source))
-        root = self.fetch_from_url(source) if source_is_url else etree.parse(source).getroot()
-        assert root.tag == 'open511'
 
-        created = []
+        progress = {
+            'next_url': source,
+            'page_offset': 0,
+            'objects_imported': 0,
+            'imported_ids': [],
+            'complete': False
+        }
+        if self.chunked:
+            self.task_status, _ = ImportTaskStatus.objects.get_or_create(
+                id=('open511_import ' + source)[:300])
+            if options['resume']:
+                if self.task_status.status_info.get('complete', True):
+                    raise CommandError("There's no interrupted import of %s to resume." % source)
+                progress = self.task_status.status_info
+                logger.info("Resuming at %s, entry %s" % (progress['next_url'], progress['page_offset']))
+
+        page_url = progress['next_url']
+        root = self.fetch_from_url(page_url) if source_is_url else etree.parse(source).getroot()
+        assert root.tag == 'open511'
 
         opts = {}
 
@@ -74,15 +109,26 @@ class Command(BaseCommand):
         while True:
             # Loop until we've dealt with all pages
 
-            for xml_obj in root.xpath(resource_type['objects']):
-                try:
-                    _, db_obj = resource_type['model'].objects.update_or_create_from_xml(xml_obj, **opts)
-                    logger.info("Imported %s %s" % (xml_obj.tag, db_obj.id))
-
-                    created.append(db_obj)
-
-                except (ValueError, ValidationError, Open511ValidationError) as e:
-                    logger.error("%s importing %s: %s" % (e.__class__.__name__, xml_obj.findtext('id'), e))
+            xml_objs = root.xpath(resource_type['objects'])[progress['page_offset']:]
+            chunk_size = options['commit_every'] or len(xml_objs) or 1
+            for chunk_start in range(0, len(xml_objs), chunk_size):
+                chunk = xml_objs[chunk_start:chunk_start + chunk_size]
+                with transaction.atomic():
+                    for xml_obj in chunk:
+                        try:
+                            _, db_obj = resource_type['model'].objects.update_or_create_from_xml(xml_obj, **opts)
+                            logger.info("Imported %s %s" % (xml_obj.tag, db_obj.id))
+
+                            progress['objects_imported'] += 1
+                            if options['archive']:
+                                progress['imported_ids'].append(db_obj.id)
+
+                        except (ValueError, ValidationError, Open511ValidationError) as e:
+                            logger.error("%s importing %s: %s" % (e.__class__.__name__, xml_obj.findtext('id'), e))
+                    progress['page_offset'] += len(chunk)
+                    self.save_progress(progress)
+                if resource_type['model'] == RoadEvent:
+                    match_subscriptions_on_commit()
 
             next_link = root.xpath('pagination/link[@rel="next"]')
             if not next_link:
@@ -92,20 +138,34 @@ class Command(BaseCommand):
                     "not following the link. If you want to fetch other pages, use the URL of the "
                     "first page as the argument to this command.")
                 break
-            next_url = urljoin(source, next_link[0].get('href'))
-            root = self.fetch_from_url(next_url)
+            page_url = urljoin(page_url, next_link[0].get('href'))
+            progress.update(next_url=page_url, page_offset=0)
+            root = self.fetch_from_url(page_url)
 
-        msg = "%s entries imported." % len(created)
+        msg = "%s entries imported." % progress['objects_imported']
 
-        if options['archive'] and created:
+        if options['archive'] and progress['imported_ids']:
             archive_jurisdiction = Jurisdiction.objects.get(id=archive_jurisdiction_id)
-            updated = RoadEvent.objects.filter(jurisdiction=archive_jurisdiction, active=True).exclude(
-                id__in=[rdev.id for rdev in created]).update(active=False)
+            updated = RoadEvent.objects.update_and_record(
+                RoadEvent.objects.filter(jurisdiction=archive_jurisdiction, active=True).exclude(
+                    id__in=progress['imported_ids']),
+                'ARCHIVED', active=False)
             msg += " %s events archived." % updated
+            match_subscriptions_on_commit()
+
+        progress['complete'] = True
+        self.save_progress(progress)
 
         if not options['quiet']:
             print(msg)
 
+    def save_progress(self, progress):
+        """In chunked mode, checkpoint how far we've gotten in ImportTaskStatus."""
+        if not self.chunked:
+            return
+        self.task_status.status_info = progress
+        self.task_status.save()
+
     def fetch_from_url(self, url):
         resp = requests.get(url, headers={
             'Accept': 'application/xml; */*;q=0.1',
@@ -0,0 +1,26 @@
+"""
+To be executed in a cron job: deletes the saved search geometries (from
+?geography= filters) that haven't been used in a while.
+"""
+from __future__ import print_function
+
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from open511_server.models import SearchGeometry, _now
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+            help='Delete geometries unused for this many days')
+
+    def handle(self, **options):
+        cutoff = _now() - datetime.timedelta(days=options['days'])
+        _, counts = SearchGeometry.objects.filter(last_used__lt=cutoff).delete()
+        # Not counting the pieces deleted along with them
+        count = counts.get(SearchGeometry._meta.label, 0)
+        if count:
+            print('%s search geometr%s deleted' % (count, 'ies' if count > 1 else 'y'))
@@ -1,33 +1,25 @@
 """
-To be executed in a cron job: finds all unpublished events with a
-<protected:publish_on> date of today or earlier, and publishes
-them.
+To be executed in a cron job: publishes all unpublished events whose
+<protected:publish_on> date has arrived.
+
+Superseded by the run_transitions command, which applies these changes
+as soon as they're due.
 """
 from __future__ import print_function
 
-import datetime
-
 from django.core.management.base import BaseCommand
 
-from open511.utils.serialization import NSMAP
-
 from open511_server.models import RoadEvent
+from open511_server.subscriptions import match_subscriptions_on_commit
 
 class Command(BaseCommand):
 
     def handle(self, **options):
 
-        count = 0
-
-        for rdev in (RoadEvent.objects.filter(published=False)
-                .extra(where=["(xpath('protected:publish_on/text()', xml_data, ARRAY[ARRAY['protected', 'http://open511.org/internal-namespace']]))[1]::text::date <= date %s"],
-                params=[datetime.date.today()])):
-            el = rdev.xml_elem.xpath('protected:publish_on', namespaces=NSMAP)[0]
-            el.getparent().remove(el)
-            rdev.published = True
-            rdev.save()
-            count += 1
+        # In case run_transitions --recompute hasn't been run since upgrading
+        RoadEvent.objects.schedule_unscheduled_publications()
+        count = RoadEvent.objects.apply_due_publications()
 
         if count:
+            match_subscriptions_on_commit()
             print('%s event%s published' % (count, 's' if count > 1 else ''))
-
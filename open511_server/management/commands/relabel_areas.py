@@ -0,0 +1,55 @@
+"""
+Brings the <areas> labels of existing events up to date with auto-label
+Areas: adds areas to events within them, and removes them from events
+that no longer are.
+
+Saving or deleting an Area does this automatically for that area (unless
+OPEN511_RELABEL_ON_AREA_SAVE is off); this command is for bulk changes.
+With --unlabel, it instead removes the given area IDs from events, e.g.
+for areas deleted while OPEN511_RELABEL_ON_AREA_SAVE was off.
+"""
+from __future__ import print_function
+
+from django.core.management.base import BaseCommand, CommandError
+
+from open511_server.models import Area, RoadEvent
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('area_ids', nargs='*', metavar='area_id',
+            help="IDs of the areas to relabel. By default, all auto-label areas.")
+        parser.add_argument('--include-archived', action='store_true', dest='include_archived',
+            help="Relabel archived events too.")
+        parser.add_argument('--chunk-size', type=int, default=500, dest='chunk_size',
+            help="How many events to update at once.")
+        parser.add_argument('--unlabel', action='store_true',
+            help="Remove the given area IDs from events' labels.")
+
+    def handle(self, area_ids, **options):
+        if options['unlabel']:
+            if not area_ids:
+                raise CommandError("--unlabel needs the IDs of the areas to remove")
+            total = 0
+            for area_id in area_ids:
+                total += RoadEvent.objects.unlabel_area(area_id,
+                    include_archived=options['include_archived'], chunk_size=options['chunk_size'])
+            print("%s events unlabelled" % total)
+            return
+
+        areas = list(Area.objects.filter(auto_label=True).order_by('internal_id'))
+        if area_ids:
+            areas = [area for area in areas if area.id in area_ids]
+            missing = set(area_ids) - set(area.id for area in areas)
+            if missing:
+                raise CommandError("No auto-label areas with IDs: %s" % ', '.join(sorted(missing)))
+
+        total = 0
+        for area in areas:
+            changed = RoadEvent.objects.relabel_area(area,
+                include_archived=options['include_archived'], chunk_size=options['chunk_size'])
+            if changed:
+                print("%s: %s events relabelled" % (area, changed))
+            total += changed
+        print("%s events relabelled" % total)
@@ -0,0 +1,68 @@
+"""
+A long-running process that publishes and archives events when they're due.
+
+Each event's next transition is computed when it's saved (see RoadEvent.get_next_transition);
+this command sleeps until the earliest one and applies all due transitions in bulk.
+Run with --recompute once after upgrading, to schedule transitions for existing events.
+"""
+from __future__ import print_function
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from open511_server.models import RoadEvent, _now
+from open511_server.subscriptions import match_subscriptions_on_commit
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help="Apply any transitions that are due, then exit.")
+        parser.add_argument('--recompute', action='store_true',
+            help="Recalculate the next transition for every event that could have one.")
+        parser.add_argument('--max-sleep', type=int, default=300, dest='max_sleep',
+            help="Check for newly scheduled transitions at least this often, in seconds.")
+
+    def handle(self, **options):
+        logging.basicConfig()
+
+        if options['recompute']:
+            self.recompute()
+
+        while True:
+            self.apply_due()
+            if options['once']:
+                break
+
+            sleep_for = options['max_sleep']
+            next_time = RoadEvent.objects.next_transition_time()
+            if next_time:
+                sleep_for = min(sleep_for, max((next_time - _now()).total_seconds(), 0) + 1)
+            time.sleep(sleep_for)
+
+    def apply_due(self):
+        now = _now()
+        published = RoadEvent.objects.apply_due_publications(now)
+        archived = RoadEvent.objects.apply_due_archives(now)
+        if published or archived:
+            match_subscriptions_on_commit()
+            logger.info("%s events published, %s events archived" % (published, archived))
+        return published, archived
+
+    def recompute(self):
+        count = 0
+        candidates = RoadEvent.objects.filter(
+            Q(published=False) | Q(active=True, jurisdiction__external_url=''))
+        for rdev in candidates.iterator():
+            next_transition, next_transition_at = rdev.get_next_transition()
+            if (next_transition, next_transition_at) != (rdev.next_transition, rdev.next_transition_at):
+                RoadEvent.objects.filter(internal_id=rdev.internal_id).update(
+                    next_transition=next_transition, next_transition_at=next_transition_at)
+                count += 1
+        logger.info("Rescheduled transitions for %s events" % count)
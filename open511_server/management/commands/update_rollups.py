@@ -0,0 +1,40 @@
+"""
+Updates the hourly analytics rollups from the change log; run it from cron,
+or keep it running with --watch. The analytics endpoint only reports what
+this has counted so far.
+
+With --rebuild, recomputes them from scratch, e.g. after upgrading.
+"""
+from __future__ import print_function
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from open511_server.analytics import rebuild_rollups, update_rollups
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+            help="Discard the rollups and recompute them from every event.")
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+            help="Keep running, updating the rollups every SECONDS seconds.")
+
+    def handle(self, **options):
+        if options['rebuild']:
+            print("%s events counted" % rebuild_rollups())
+            return
+
+        while True:
+            updated = update_rollups()
+            if updated is None:
+                print("Rollups are being updated by another process")
+            elif updated:
+                print("%s events updated" % updated)
+            if not options['watch']:
+                return
+            close_old_connections()
+            time.sleep(options['watch'])
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0008_add_import_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roadevent',
+            name='next_transition',
+            field=models.CharField(blank=True, choices=[('publish', 'Publish'), ('archive', 'Archive')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='roadevent',
+            name='next_transition_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import open511_server.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0009_roadevent_next_transition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGeometry',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('geom', django.contrib.gis.db.models.fields.GeometryField(srid=4326)),
+                ('created', models.DateTimeField(default=open511_server.models._now)),
+            ],
+            options={
+                'verbose_name': 'Search geometry',
+                'verbose_name_plural': 'Search geometries',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchGeometryPiece',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geom', django.contrib.gis.db.models.fields.GeometryField(geography=True, srid=4326)),
+                ('search_geometry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pieces', to='open511.SearchGeometry')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0010_searchgeometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='area',
+            name='simplified_geography',
+            field=jsonfield.fields.JSONField(blank=True, default={}, editable=False, help_text='Pre-rendered GML for each simplification level'),
+        ),
+        migrations.AddField(
+            model_name='jurisdictiongeography',
+            name='simplified_geography',
+            field=jsonfield.fields.JSONField(blank=True, default={}, editable=False, help_text='Pre-rendered GML for each simplification level'),
+        ),
+        migrations.AddField(
+            model_name='roadevent',
+            name='simplified_geography',
+            field=jsonfield.fields.JSONField(blank=True, default={}, editable=False, help_text='Pre-rendered GML for each simplification level'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Planar GiST indexes on the geography columns cast to geometry,
+    used by the bbox filter."""
+
+    dependencies = [
+        ('open511', '0011_simplified_geography'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX open511_roadevent_geom_geometry_idx ON open511_roadevent USING GIST ((geom::geometry))",
+            "DROP INDEX open511_roadevent_geom_geometry_idx"
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX open511_camera_geom_geometry_idx ON open511_camera USING GIST ((geom::geometry))",
+            "DROP INDEX open511_camera_geom_geometry_idx"
+        ),
+    ]
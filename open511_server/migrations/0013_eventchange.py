@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import open511_server.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0012_geometry_bbox_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventChange',
+            fields=[
+                ('sequence', models.BigAutoField(primary_key=True, serialize=False)),
+                ('full_id', models.CharField(db_index=True, max_length=201)),
+                ('change_type', models.CharField(choices=[('CREATED', 'Created'), ('UPDATED', 'Updated'), ('ARCHIVED', 'Archived'), ('PUBLISHED', 'Published'), ('DELETED', 'Deleted')], max_length=10)),
+                ('published', models.BooleanField(default=True)),
+                ('created', models.DateTimeField(default=open511_server.models._now)),
+            ],
+            options={
+                'verbose_name': 'Event change',
+                'verbose_name_plural': 'Event changes',
+                'ordering': ('sequence',),
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import open511_server.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0013_eventchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('callback_url', models.URLField(max_length=500)),
+                ('secret', models.CharField(blank=True, max_length=100)),
+                ('geom', django.contrib.gis.db.models.fields.GeometryField(geography=True, srid=4326)),
+                ('event_types', models.CharField(blank=True, max_length=200)),
+                ('severities', models.CharField(blank=True, max_length=200)),
+                ('active', models.BooleanField(default=True)),
+                ('start_sequence', models.BigIntegerField(default=0, editable=False)),
+                ('created', models.DateTimeField(default=open511_server.models._now)),
+                ('jurisdiction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='open511.Jurisdiction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubscriptionDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DELIVERED', 'Delivered'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=open511_server.models._now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=open511_server.models._now)),
+                ('change', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='open511.EventChange')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='open511.Subscription')),
+            ],
+            options={
+                'verbose_name_plural': 'Subscription deliveries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscriptiondelivery',
+            unique_together=set([('subscription', 'change')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='subscriptiondelivery',
+            index_together=set([('status', 'next_attempt_at')]),
+        ),
+    ]
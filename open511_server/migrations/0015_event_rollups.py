@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0014_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventFact',
+            fields=[
+                ('full_id', models.CharField(max_length=201, primary_key=True, serialize=False)),
+                ('jurisdiction', models.CharField(max_length=100)),
+                ('event_type', models.CharField(max_length=50)),
+                ('severity', models.CharField(max_length=50)),
+                ('areas', models.TextField(blank=True)),
+                ('started', models.DateTimeField()),
+                ('ended', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(db_index=True)),
+                ('jurisdiction', models.CharField(max_length=100)),
+                ('area_id', models.CharField(max_length=100)),
+                ('event_type', models.CharField(max_length=50)),
+                ('severity', models.CharField(max_length=50)),
+                ('started', models.IntegerField(default=0)),
+                ('ended', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventrollup',
+            unique_together=set([('bucket', 'jurisdiction', 'area_id', 'event_type', 'severity')]),
+        ),
+    ]
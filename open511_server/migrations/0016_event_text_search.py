@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The text search configuration for a language code like 'fr' or 'en-CA'
+SEARCH_CONFIG_SQL = """CREATE FUNCTION open511_search_config(lang text) RETURNS regconfig AS $$
+    SELECT (CASE split_part(lower(lang), '-', 1)
+        WHEN 'da' THEN 'danish' WHEN 'de' THEN 'german' WHEN 'en' THEN 'english'
+        WHEN 'es' THEN 'spanish' WHEN 'fi' THEN 'finnish' WHEN 'fr' THEN 'french'
+        WHEN 'hu' THEN 'hungarian' WHEN 'it' THEN 'italian' WHEN 'nl' THEN 'dutch'
+        WHEN 'no' THEN 'norwegian' WHEN 'pt' THEN 'portuguese' WHEN 'ro' THEN 'romanian'
+        WHEN 'ru' THEN 'russian' WHEN 'sv' THEN 'swedish' WHEN 'tr' THEN 'turkish'
+        ELSE 'simple' END)::regconfig
+$$ LANGUAGE sql IMMUTABLE"""
+
+TSVECTOR_AGG_SQL = """CREATE AGGREGATE open511_tsvector_agg(tsvector) (
+    SFUNC = tsvector_concat, STYPE = tsvector, INITCOND = ''
+)"""
+
+# Each element is parsed in its own language: its xml:lang, or else the event's.
+# The search_path is pinned so the CREATE INDEX below, which Postgres 17+ runs
+# with only pg_catalog on the path, can find our functions.
+SEARCH_VECTOR_SQL = """CREATE FUNCTION open511_event_search_vector(data xml) RETURNS tsvector AS $$
+    SELECT coalesce(open511_tsvector_agg(setweight(to_tsvector(
+            open511_search_config(coalesce(
+                (xpath('@xml:lang', el))[1]::text,
+                (xpath('@xml:lang', data))[1]::text,
+                ''
+            )),
+            array_to_string(xpath('text()', el)::text[], ' ')
+        ), weight)), ''::tsvector)
+    FROM (
+        SELECT unnest(xpath('headline', data)) AS el, 'A'::"char" AS weight
+        UNION ALL SELECT unnest(xpath('roads/road/name', data)), 'B'
+        UNION ALL SELECT unnest(xpath('areas/area/name', data)), 'B'
+        UNION ALL SELECT unnest(xpath('description', data)), 'C'
+    ) AS elements
+$$ LANGUAGE sql IMMUTABLE SET search_path FROM CURRENT"""
+
+ROAD_NAMES_SQL = """CREATE FUNCTION open511_event_road_names(data xml) RETURNS text AS $$
+    SELECT array_to_string(xpath('roads/road/name/text()', data)::text[], ' ')
+$$ LANGUAGE sql IMMUTABLE"""
+
+
+class Migration(migrations.Migration):
+    """GIN expression indexes for the q= search on events: full-text over
+    the headline, description, road names and area names, and trigrams
+    over road names for fuzzy matching."""
+
+    dependencies = [
+        ('open511', '0015_event_rollups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(SEARCH_CONFIG_SQL, "DROP FUNCTION open511_search_config(text)"),
+        migrations.RunSQL(TSVECTOR_AGG_SQL, "DROP AGGREGATE open511_tsvector_agg(tsvector)"),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, "DROP FUNCTION open511_event_search_vector(xml)"),
+        migrations.RunSQL(ROAD_NAMES_SQL, "DROP FUNCTION open511_event_road_names(xml)"),
+        migrations.RunSQL(
+            "CREATE INDEX open511_roadevent_search_idx ON open511_roadevent "
+            "USING GIN (open511_event_search_vector(xml_data))",
+            "DROP INDEX open511_roadevent_search_idx"
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX open511_roadevent_road_names_trgm_idx ON open511_roadevent "
+            "USING GIN (open511_event_road_names(xml_data) gin_trgm_ops)",
+            "DROP INDEX open511_roadevent_road_names_trgm_idx"
+        ),
+    ]
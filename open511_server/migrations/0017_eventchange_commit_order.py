@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """EventChange sequence numbers are now handed out in commit order, by
+    EventChange.assign_sequences(), rather than on insert; the old
+    insert-order numbers become the id, and carry over as existing
+    changes' sequence numbers."""
+
+    dependencies = [
+        ('open511', '0016_event_text_search'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='eventchange',
+            old_name='sequence',
+            new_name='id',
+        ),
+        migrations.AddField(
+            model_name='eventchange',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE open511_eventchange_commit_seq",
+            "DROP SEQUENCE open511_eventchange_commit_seq"
+        ),
+        migrations.RunSQL(
+            "UPDATE open511_eventchange SET sequence = id; "
+            "SELECT setval('open511_eventchange_commit_seq', coalesce(max(id), 0) + 1, false) "
+            "FROM open511_eventchange",
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX open511_eventchange_unnumbered_idx ON open511_eventchange (id) "
+            "WHERE sequence IS NULL",
+            "DROP INDEX open511_eventchange_unnumbered_idx"
+        ),
+    ]
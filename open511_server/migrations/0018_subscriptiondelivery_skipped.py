@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0017_eventchange_commit_order'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscriptiondelivery',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('DELIVERED', 'Delivered'), ('FAILED', 'Failed'), ('SKIPPED', 'Skipped')], default='PENDING', max_length=10),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import open511_server.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0018_subscriptiondelivery_skipped'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchgeometry',
+            name='last_used',
+            field=models.DateTimeField(db_index=True, default=open511_server.models._now),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Indexes the IDs of the areas events are labelled with, so that
+    relabelling an Area can find the events it's already on."""
+
+    dependencies = [
+        ('open511', '0019_searchgeometry_last_used'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX open511_roadevent_area_ids_idx ON open511_roadevent "
+            "USING GIN ((xpath('areas/area/id/text()', xml_data)::text[]))",
+            "DROP INDEX open511_roadevent_area_ids_idx"
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from open511_server.utils.geometry import simplified_variants
+
+def backfill_simplified_geography(apps, schema_editor):
+    # Areas and jurisdiction geographies saved before 0011 have no
+    # simplified versions. Events compute theirs when they're needed.
+    for model_name in ('Area', 'JurisdictionGeography'):
+        model = apps.get_model('open511', model_name)
+        for obj in model.objects.exclude(geom=None).only('pk', 'geom', 'simplified_geography'):
+            if not obj.simplified_geography:
+                model.objects.filter(pk=obj.pk).update(simplified_geography=simplified_variants(obj.geom))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('open511', '0020_roadevent_area_ids_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_simplified_geography, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """open511_event_search_vector calls open511_search_config and
+    open511_tsvector_agg unqualified. Index builds, REINDEX, autovacuum and
+    restores may run it with a search_path of only pg_catalog (always, as of
+    Postgres 17), where those can't be found; pin it to the schema they
+    were created in. (0016 now does this itself, for new databases.)"""
+
+    dependencies = [
+        ('open511', '0021_backfill_simplified_geography'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "ALTER FUNCTION open511_event_search_vector(xml) SET search_path FROM CURRENT",
+            "ALTER FUNCTION open511_event_search_vector(xml) RESET search_path"
+        ),
+    ]
@@ -3,8 +3,11 @@ try:
 except NameError:
     unicode = str
 
+from collections import OrderedDict
 from copy import deepcopy
 import datetime
+import logging
+import threading
 try:
     from urlparse import urljoin
 except ImportError:
@@ -16,6 +19,9 @@ from django.contrib.gis.geos import fromstr as geos_geom_from_string
 from django.core import urlresolvers
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import connection, IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver, Signal
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from django.utils.timezone import utc
@@ -35,14 +41,33 @@ from open511.utils.serialization import XML_LANG, NSMAP, make_link
 from open511_server.conf import settings
 from open511_server.fields import XMLField
 from open511_server.utils import is_hex
+from open511_server.utils.areaindex import get_area_index, invalidate_area_index
+from open511_server.utils.geometry import simplified_variants
 from open511_server.utils.optimization import get_cached_object, memoize_method
 from open511_server.utils.postgis import gml_to_ewkt
+from open511_server.utils.schedule import has_remaining_periods as schedule_has_remaining_periods
 from open511_server.utils.xmlmodel import XMLModelMixin
 
+logger = logging.getLogger(__name__)
+
+
+# Sent, after they've committed, whenever recorded EventChanges are given
+# sequence numbers; count is how many were.
+event_changes_recorded = Signal(providing_args=['count'])
+
 
 def _now():
     return datetime.datetime.now(utc).replace(microsecond=0)  # microseconds == overkill
 
+def _field_name(el):
+    """The name by which fields= refers to a top-level element: its tag
+    without namespace, or for a link, its rel."""
+    if callable(el.tag):
+        # A comment or processing instruction
+        return None
+    tagname = el.tag.partition('}')[2] if '}' in el.tag else el.tag
+    return el.get('rel') if tagname == 'link' else tagname
+
 class _Open511Model(models.Model):
 
     created = models.DateTimeField(default=_now, db_index=True)
@@ -141,6 +166,10 @@ class Jurisdiction(_Open511Model, XMLModelMixin):
 
     FREE_TEXT_TAGS = ['name', 'description']
 
+    # Taken by URLs under /events/ (e.g. /events/summary/), which would
+    # shadow a jurisdiction's events list
+    RESERVED_IDS = frozenset(['batch', 'routes', 'summary', 'tiles'])
+
     class Meta(object):
         verbose_name = _('Jurisdiction')
         verbose_name_plural = _('Jurisdictions')
@@ -148,6 +177,10 @@ class Jurisdiction(_Open511Model, XMLModelMixin):
     def __str__(self):
         return self.id
 
+    def clean(self):
+        if self.id in self.RESERVED_IDS:
+            raise ValidationError({'id': "%s is reserved, and can't be used as a jurisdiction ID" % self.id})
+
     def get_absolute_url(self):
         return urlresolvers.reverse('open511_jurisdiction', kwargs={'id': self.id})
 
@@ -195,6 +228,9 @@ class JurisdictionGeography(models.Model):
 
     geom = models.GeometryField()
 
+    simplified_geography = JSONField(default={}, blank=True, editable=False,
+        help_text='Pre-rendered GML for each simplification level')
+
     objects = models.GeoManager()
 
     class Meta:
@@ -204,6 +240,10 @@ class JurisdictionGeography(models.Model):
     def __str__(self):
         return u"Geography for %s" % self.jurisdiction
 
+    def save(self, *args, **kwargs):
+        self.simplified_geography = simplified_variants(self.geom)
+        super(JurisdictionGeography, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         return self.jurisdiction.get_absolute_url() + 'geography/'
 
@@ -289,6 +329,11 @@ class _Open511CommonModel(_Open511Model, XMLModelMixin):
     last_import_hash = models.CharField(max_length=32, blank=True,
         help_text='MD5 of the input XML the last time this was imported')
 
+    # The tag of the root XML element
+    XML_TAG = None
+    # Fields (as element names, or link rels) rendered from columns rather than from xml_data
+    COLUMN_FIELDS = frozenset(['id', 'self', 'jurisdiction'])
+
     class Meta(object):
         abstract = True
         ordering = ('internal_id',)
@@ -322,24 +367,36 @@ class _Open511CommonModel(_Open511Model, XMLModelMixin):
             self.id = self.internal_id
 
     def to_full_xml_element(self, accept_language=None,
-            fake_links=False, remove_internal_elements=False):
-
-        el = deepcopy(self.xml_elem)
+            fake_links=False, remove_internal_elements=False, fields=None):
+        """fields, if provided, is the set of top-level element names (or link rels)
+        to include; if they're all COLUMN_FIELDS, xml_data isn't used at all."""
+
+        if fields is None:
+            el = deepcopy(self.xml_elem)
+        elif fields <= self.COLUMN_FIELDS:
+            el = etree.Element(self.XML_TAG)
+        else:
+            el = etree.Element(self.xml_elem.tag, self.xml_elem.attrib, nsmap=self.xml_elem.nsmap)
+            el.extend(deepcopy(child) for child in self.xml_elem if _field_name(child) in fields)
 
         if fake_links:
             el.insert(0, E.id('xxx.yyy/x%s' % self.id))
             el.insert(0, make_link('jurisdiction', 'http://example.org/xxx'))
             el.insert(0, make_link('self', '/xxx/yyy'))
         else:
-            el.insert(0, E.id(self.full_id))
-            el.insert(0, make_link('jurisdiction', self.cached_jurisdiction.full_url))
-            el.insert(0, make_link('self', self.url))
+            for name, make_el in [
+                    ('id', lambda: E.id(self.full_id)),
+                    ('jurisdiction', lambda: make_link('jurisdiction', self.cached_jurisdiction.full_url)),
+                    ('self', lambda: make_link('self', self.url))]:
+                if fields is None or name in fields:
+                    el.insert(0, make_el())
 
         if remove_internal_elements:
             for internal_element in el.xpath('//*[namespace-uri()="' + NSMAP['protected'] + '"]'):
                 internal_element.getparent().remove(internal_element)
 
-        self.remove_unnecessary_languages(accept_language, el)
+        if fields is None or not fields <= self.COLUMN_FIELDS:
+            self.remove_unnecessary_languages(accept_language, el)
 
         return el
 
@@ -370,7 +427,7 @@ class _Open511CommonModel(_Open511Model, XMLModelMixin):
 
 class RoadEventManager(_Open511CommonManager):
     def update_or_create_from_xml(self, el,
-            default_language=settings.LANGUAGE_CODE, base_url=''):
+            default_language=settings.LANGUAGE_CODE, base_url='', save=True):
 
         obj_created, rdev = super(RoadEventManager, self).update_or_create_from_xml(
             el, default_language, base_url, save=False)
@@ -397,20 +454,231 @@ class RoadEventManager(_Open511CommonManager):
             for elem in rdev.xml_elem.xpath(path):
                 rdev.xml_elem.remove(elem)
 
-        rdev.save()
+        if save:
+            rdev.save()
         return obj_created, rdev
 
+    def update_and_record(self, qs, change_type, **updates):
+        """Runs a bulk update on a QuerySet of events, and records it in the
+        change log. Returns the number of events updated."""
+        rows = list(qs.values_list('internal_id', 'id', 'jurisdiction__id', 'published'))
+        if not rows:
+            return 0
+        # As save() would, so that updated= filters see the change
+        updates.setdefault('updated', _now())
+        count = self.filter(internal_id__in=[row[0] for row in rows]).update(**updates)
+        EventChange.record([
+            EventChange(
+                full_id=u'/'.join((jurisdiction_id, id)),
+                change_type=change_type,
+                published=updates.get('published', published)
+            ) for internal_id, id, jurisdiction_id, published in rows
+        ])
+        return count
+
+    def save_batch(self, events):
+        """Saves many new or changed RoadEvents, as their save() would, but with
+        one INSERT for all the new ones and their changes recorded together.
+        The events must already have been validated with full_clean()."""
+        now = _now()
+        for rdev in events:
+            rdev.updated = now
+            rdev.next_transition, rdev.next_transition_at = rdev.get_next_transition()
+            rdev.simplified_geography = simplified_variants(rdev.geom)
+            rdev.xml_data = etree.tostring(rdev.xml_elem)
+
+        new = [rdev for rdev in events if not rdev.internal_id]
+        if new:
+            # Take primary keys from the sequence up front, so that the
+            # default IDs can be inserted along with everything else
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'internal_id')) "
+                    "FROM generate_series(1, %s)", [self.model._meta.db_table, len(new)])
+                for rdev, (internal_id,) in zip(new, cursor.fetchall()):
+                    rdev.internal_id = internal_id
+                    if not rdev.id:
+                        rdev.id = unicode(internal_id)
+            self.bulk_create(new)
+
+        new_ids = set(rdev.internal_id for rdev in new)
+        for rdev in events:
+            if rdev.internal_id not in new_ids:
+                self.filter(internal_id=rdev.internal_id).update(**dict(
+                    (field, getattr(rdev, field)) for field in (
+                        'xml_data', 'geom', 'active', 'published', 'updated',
+                        'next_transition', 'next_transition_at', 'simplified_geography')
+                ))
+
+        EventChange.record([EventChange(full_id=rdev.full_id,
+            change_type='CREATED' if rdev.internal_id in new_ids else 'UPDATED',
+            published=rdev.published) for rdev in events])
+
+    def relabel_area(self, area, include_archived=False, chunk_size=500):
+        """Brings existing events' labels for an auto-label Area up to date.
+
+        Finds the events that are within the area or already labelled with it,
+        then rewrites their <areas> blocks -- adding, refreshing or removing the
+        area -- in chunks of chunk_size events, each a separate short transaction,
+        so a huge area doesn't lock every event at once.
+        Returns the number of events changed."""
+        if not (area.auto_label and area.geom and area.id):
+            return 0
+        with connection.cursor() as cursor:
+            # Two queries rather than an OR, so that each can use its index
+            cursor.execute("""SELECT e.internal_id FROM open511_roadevent e
+                WHERE (e.active OR %s) AND ST_Intersects(e.geom::geometry, ST_GeomFromEWKT(%s))""",
+                [include_archived, area.geom.ewkt])
+            within = dict((internal_id, True) for (internal_id,) in cursor.fetchall())
+        for internal_id in self._labelled_with(area.id, include_archived):
+            within.setdefault(internal_id, False)
+        return self._rewrite_area_labels(area.id, within, area.xml_elem, chunk_size)
+
+    def unlabel_area(self, area_id, include_archived=False, chunk_size=500):
+        """Removes an area from the labels of existing events, after it's been
+        deleted or is no longer auto-label. Returns the number of events changed."""
+        if not area_id:
+            return 0
+        within = dict((internal_id, False) for internal_id in self._labelled_with(area_id, include_archived))
+        return self._rewrite_area_labels(area_id, within, None, chunk_size)
+
+    def _labelled_with(self, area_id, include_archived):
+        # Uses the GIN index on labelled area IDs, from migration 0020
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT e.internal_id FROM open511_roadevent e
+                WHERE (e.active OR %s)
+                AND xpath('areas/area/id/text()', e.xml_data)::text[] @> ARRAY[%s]::text[]""",
+                [include_archived, area_id])
+            return [internal_id for (internal_id,) in cursor.fetchall()]
+
+    def _rewrite_area_labels(self, area_id, within, area_elem, chunk_size):
+        """Takes a dict of event internal IDs to whether they should be labelled
+        with area_elem, and updates those that need it, a locked chunk at a time."""
+        internal_ids = sorted(within)
+        changed = 0
+        for i in range(0, len(internal_ids), chunk_size):
+            with transaction.atomic():
+                updates = []
+                for rdev in self.filter(internal_id__in=internal_ids[i:i + chunk_size]).select_for_update():
+                    old_xml = etree.tostring(rdev.xml_elem)
+                    areas_el = rdev.xml_elem.find('areas')
+                    if areas_el is not None:
+                        for area_el in areas_el.xpath('area[id=$id]', id=area_id):
+                            areas_el.remove(area_el)
+                    if within[rdev.internal_id]:
+                        if areas_el is None:
+                            areas_el = E.areas()
+                            rdev.xml_elem.append(areas_el)
+                        areas_el.append(deepcopy(area_elem))
+                    elif areas_el is not None and not len(areas_el):
+                        rdev.xml_elem.remove(areas_el)
+                    new_xml = etree.tostring(rdev.xml_elem)
+                    if new_xml != old_xml:
+                        updates.append((rdev, new_xml.decode('utf8')))
+                if not updates:
+                    continue
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE open511_roadevent e SET xml_data = v.xml_data::xml, updated = %s "
+                        "FROM (VALUES " + ', '.join(['(%s, %s)'] * len(updates)) + ") v(internal_id, xml_data) "
+                        "WHERE e.internal_id = v.internal_id",
+                        [_now()] + [val for rdev, xml in updates for val in (rdev.internal_id, xml)])
+                EventChange.record([EventChange(full_id=rdev.full_id, change_type='UPDATED',
+                    published=rdev.published) for rdev, xml in updates])
+            changed += len(updates)
+        return changed
+
+    def apply_due_archives(self, now=None):
+        """Archives every event whose scheduled archive time has passed.
+        Returns the number of events archived."""
+        if now is None:
+            now = _now()
+        return self.update_and_record(
+            self.filter(next_transition='archive', next_transition_at__lte=now), 'ARCHIVED',
+            active=False, next_transition='', next_transition_at=None)
+
+    def apply_due_publications(self, now=None):
+        """Publishes every event whose <protected:publish_on> time has passed.
+        Returns the number of events published."""
+        if now is None:
+            now = _now()
+        due = self.filter(next_transition='publish', next_transition_at__lte=now)
+        internal_ids = list(due.values_list('internal_id', flat=True))
+        if not internal_ids:
+            return 0
+        count = self.update_and_record(self.filter(internal_id__in=internal_ids), 'PUBLISHED',
+            published=True, next_transition='', next_transition_at=None)
+        for rdev in self.filter(internal_id__in=internal_ids):
+            # Drop the publish_on date, so that unpublishing the event later sticks
+            for el in rdev.xml_elem.xpath('protected:publish_on', namespaces=NSMAP):
+                el.getparent().remove(el)
+            # and now that they're published, some of these events have an archive time to schedule
+            next_transition, next_transition_at = rdev.get_next_transition()
+            self.filter(internal_id=rdev.internal_id).update(
+                xml_data=etree.tostring(rdev.xml_elem).decode('utf8'),
+                next_transition=next_transition, next_transition_at=next_transition_at)
+        return count
+
+    def schedule_unscheduled_publications(self):
+        """Computes the next transition for unpublished events with a publish_on
+        date but no transition scheduled: those saved before transitions existed,
+        if run_transitions --recompute hasn't been run. Returns how many."""
+        return self._schedule_transitions(self.filter(published=False, next_transition='').extra(
+            where=["xpath_exists('protected:publish_on', open511_roadevent.xml_data, "
+                "ARRAY[ARRAY['protected', %s]])"], params=[NSMAP['protected']]))
+
+    def schedule_unscheduled_archives(self):
+        """Computes the next transition for active, published local events with
+        none scheduled: those saved before transitions existed, if run_transitions
+        --recompute hasn't been run, along with open-ended ones, which still
+        won't have one. Returns how many were scheduled."""
+        return self._schedule_transitions(self.filter(
+            published=True, active=True, next_transition='', jurisdiction__external_url=''))
+
+    def _schedule_transitions(self, qs):
+        count = 0
+        for rdev in qs.iterator():
+            next_transition, next_transition_at = rdev.get_next_transition()
+            if next_transition:
+                self.filter(internal_id=rdev.internal_id).update(
+                    next_transition=next_transition, next_transition_at=next_transition_at)
+                count += 1
+        return count
+
+    def next_transition_time(self):
+        """Returns the earliest pending publish or archive time, or None."""
+        return self.exclude(next_transition='').aggregate(
+            models.Min('next_transition_at'))['next_transition_at__min']
+
+
 class RoadEvent(_Open511CommonModel):
 
+    TRANSITION_CHOICES = [
+        ('publish', 'Publish'),
+        ('archive', 'Archive'),
+    ]
+
     active = models.BooleanField(default=True)
     published = models.BooleanField(default=True, db_index=True)
 
+    # The next automatic state change for this event, and when it's due. Maintained
+    # on save, and applied by the run_transitions command.
+    next_transition = models.CharField(max_length=10, blank=True, choices=TRANSITION_CHOICES)
+    next_transition_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
     geom = models.GeometryField(verbose_name=_('Geometry'), geography=True)
+    simplified_geography = JSONField(default={}, blank=True, editable=False,
+        help_text='Pre-rendered GML for each simplification level')
     xml_data = XMLField(
         default='<event xmlns:gml="http://www.opengis.net/gml" />')
 
     objects = RoadEventManager()
 
+    XML_TAG = 'event'
+    COLUMN_FIELDS = _Open511CommonModel.COLUMN_FIELDS | frozenset(['status', 'created', 'updated', 'unpublished'])
+
+    # Taken by URLs under /events/<jurisdiction>/, which would shadow the event's own URL
+    RESERVED_IDS = frozenset(['active_set'])
+
     FREE_TEXT_TAGS = [
         'headline', 'description', 'detour', 'road_name', 'from', 'to', 'area_name'
     ]
@@ -428,6 +696,19 @@ class RoadEvent(_Open511CommonModel):
         if not self.internal_id and not self.xml_elem.get(XML_LANG):
             self.xml_elem.set(XML_LANG, lang)
 
+    def clean(self):
+        if self.id in self.RESERVED_IDS:
+            raise ValidationError({'id': "%s is reserved, and can't be used as an event ID" % self.id})
+        super(RoadEvent, self).clean()
+
+    def save(self, *args, **kwargs):
+        created = not self.internal_id
+        self.next_transition, self.next_transition_at = self.get_next_transition()
+        self.simplified_geography = simplified_variants(self.geom)
+        super(RoadEvent, self).save(*args, **kwargs)
+        EventChange.record([EventChange(full_id=self.full_id,
+            change_type='CREATED' if created else 'UPDATED', published=self.published)])
+
     def get_absolute_url(self):
         return urlresolvers.reverse('open511_roadevent', kwargs={
             'jurisdiction_id': self.cached_jurisdiction.id,
@@ -435,16 +716,20 @@ class RoadEvent(_Open511CommonModel):
         )
 
     def to_full_xml_element(self, accept_language=None,
-            fake_links=False, remove_internal_elements=False):
+            fake_links=False, remove_internal_elements=False, fields=None):
 
-        el = super(RoadEvent, self).to_full_xml_element(accept_language, fake_links, remove_internal_elements)
+        el = super(RoadEvent, self).to_full_xml_element(accept_language, fake_links, remove_internal_elements,
+            fields=fields)
 
-        el.insert(0, E.status('ACTIVE' if self.active else 'ARCHIVED'))
+        if fields is None or 'status' in fields:
+            el.insert(0, E.status('ACTIVE' if self.active else 'ARCHIVED'))
 
-        el.append(E.created(self.created.isoformat()))
-        el.append(E.updated(self.updated.isoformat()))
+        if fields is None or 'created' in fields:
+            el.append(E.created(self.created.isoformat()))
+        if fields is None or 'updated' in fields:
+            el.append(E.updated(self.updated.isoformat()))
 
-        if not remove_internal_elements and not self.published:
+        if not remove_internal_elements and not self.published and (fields is None or 'unpublished' in fields):
             unpublished = etree.Element('{%s}unpublished' % NSMAP['protected'], nsmap=NSMAP)
             unpublished.text = 'true'
             el.append(unpublished)
@@ -510,21 +795,52 @@ class RoadEvent(_Open511CommonModel):
         return Schedule.from_element(sched, timezone)
 
     def has_remaining_periods(self):
-        return self.schedule.has_remaining_intervals()
+        return schedule_has_remaining_periods(self, _now())
     has_remaining_periods.boolean = True
 
+    def get_schedule_end(self):
+        """Returns the datetime when this event's schedule stops being in effect,
+        or None if it's open-ended."""
+        schedule = self.schedule
+        if schedule.root.xpath('recurring_schedules/recurring_schedule[not(end_date)]'):
+            return None
+        periods = list(schedule.intervals(range_start=_now()))
+        if not periods:
+            # Nothing left in the schedule
+            return _now()
+        # Periods come in order of start, not end
+        if any(period.end is None for period in periods):
+            return None
+        return max(period.end for period in periods)
+
+    def get_publish_time(self):
+        """Returns the datetime from <protected:publish_on>, or None."""
+        publish_on = self.xml_elem.xpath('protected:publish_on/text()', namespaces=NSMAP)
+        if not publish_on:
+            return None
+        publish_time = dateutil.parser.parse(publish_on[0])
+        if not publish_time.tzinfo:
+            publish_time = self.schedule.to_timezone(publish_time)
+        return publish_time
+
+    def get_next_transition(self):
+        """Returns a (transition, datetime) tuple for the next automatic state
+        change of this event: publishing unpublished events on their publish_on date,
+        and archiving local events once their schedule has ended.
+        Returns ('', None) if there's nothing to do."""
+        if not self.published:
+            publish_time = self.get_publish_time()
+            if publish_time:
+                return ('publish', publish_time)
+        elif self.active and not self.cached_jurisdiction.external_url:
+            schedule_end = self.get_schedule_end()
+            if schedule_end:
+                return ('archive', schedule_end)
+        return ('', None)
+
     def auto_label_areas(self):
         """Based on geometry, include any matching Areas we know about."""
-        areas = Area.objects.filter(auto_label=True, geom__intersects=self.geom)
-        for area in areas:
-            if self.xml_elem.xpath('areas/area/area_id[text()="%s"]' % area.id):
-                continue
-            try:
-                areas_el = self.xml_elem.xpath('areas')[0]
-            except IndexError:
-                areas_el = E.areas()
-                self.xml_elem.append(areas_el)
-            areas_el.append(area.xml_elem)
+        get_area_index().label(self)
 
 
 @python_2_unicode_compatible
@@ -539,6 +855,9 @@ class Area(_Open511Model, XMLModelMixin):
     auto_label = models.BooleanField(default=False, db_index=True,
         help_text="Automatically include this Area in new events within its boundaries.")
 
+    simplified_geography = JSONField(default={}, blank=True, editable=False,
+        help_text='Pre-rendered GML for each simplification level')
+
     objects = models.GeoManager()
 
     FREE_TEXT_TAGS = ['name']
@@ -560,9 +879,231 @@ class Area(_Open511Model, XMLModelMixin):
 
     def save(self, *args, **kwargs):
         self.xml_data = etree.tostring(self.xml_elem)
+        self.simplified_geography = simplified_variants(self.geom)
         self.full_clean()
+        old = Area.objects.filter(pk=self.pk).values_list('geom', 'auto_label', 'xml_data').first() if self.pk else None
+        old_xml = etree.fromstring(old[2]) if old else None
+        # Whether existing events need relabelling; see _relabel_events
+        self._labels_changed = self.auto_label and (
+            old is None or old[1] != self.auto_label or old[0] != self.geom
+            or etree.tostring(old_xml) != self.xml_data)
+        # The ID of automatic labels to take off existing events, if the area
+        # is no longer auto-label or its ID has changed
+        old_id = old_xml.findtext('id') if old else None
+        self._unlabel_id = old_id if old and old[1] and (not self.auto_label or old_id != self.id) else None
         super(Area, self).save(*args, **kwargs)
 
+
+post_save.connect(invalidate_area_index, sender=Area)
+post_delete.connect(invalidate_area_index, sender=Area)
+
+def _logging_errors(func, *args):
+    def wrapped():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Error relabelling events")
+    return wrapped
+
+@receiver(post_save, sender=Area)
+def _relabel_events(sender, instance, **kwargs):
+    # Relabelling waits until the Area is committed, and doesn't hold up
+    # the save, so errors are logged rather than raised.
+    if not settings.OPEN511_RELABEL_ON_AREA_SAVE:
+        return
+    if getattr(instance, '_unlabel_id', None):
+        transaction.on_commit(_logging_errors(RoadEvent.objects.unlabel_area, instance._unlabel_id))
+    if getattr(instance, '_labels_changed', False):
+        transaction.on_commit(_logging_errors(RoadEvent.objects.relabel_area, instance))
+
+@receiver(post_delete, sender=Area)
+def _unlabel_events(sender, instance, **kwargs):
+    if settings.OPEN511_RELABEL_ON_AREA_SAVE and instance.auto_label:
+        transaction.on_commit(_logging_errors(RoadEvent.objects.unlabel_area, instance.id))
+
+class EventChange(models.Model):
+    """An entry in the log of changes to road events, used for the
+    incremental change feed. Deleted events leave a DELETED tombstone.
+
+    Readers page through the log by sequence, so sequence numbers are only
+    handed out once a change has committed, in commit order (see
+    assign_sequences): a change can never show up behind a reader's cursor.
+    Until then, a change's sequence is null, and readers don't see it."""
+
+    CHANGE_TYPES = [
+        ('CREATED', 'Created'),
+        ('UPDATED', 'Updated'),
+        ('ARCHIVED', 'Archived'),
+        ('PUBLISHED', 'Published'),
+        ('DELETED', 'Deleted'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    sequence = models.BigIntegerField(null=True, blank=True, unique=True, editable=False)
+    full_id = models.CharField(max_length=201, db_index=True)
+    change_type = models.CharField(max_length=10, choices=CHANGE_TYPES)
+    # Whether the event was published as of this change; unpublished changes
+    # are only shown to users who can see internal data
+    published = models.BooleanField(default=True)
+    created = models.DateTimeField(default=_now)
+
+    class Meta:
+        verbose_name = _('Event change')
+        verbose_name_plural = _('Event changes')
+        ordering = ('sequence',)
+
+    NOTIFY_CHANNEL = 'open511_event_changes'
+    SEQUENCE_NAME = 'open511_eventchange_commit_seq'
+    # The key of the advisory lock that serializes assign_sequences()
+    SEQUENCER_LOCK = 511039
+
+    @classmethod
+    def record(cls, changes):
+        """Saves a list of unsaved EventChanges. Once the transaction
+        commits, they're numbered and change stream listeners are told."""
+        cls.objects.bulk_create(changes)
+        cls.assign_sequences()
+
+    @classmethod
+    def assign_sequences(cls):
+        """Gives sequence numbers to every committed change that lacks one.
+        Returns how many were numbered.
+
+        Runs as its own short transaction, holding an advisory lock, so each
+        run's numbers are committed before the next run hands out higher ones.
+        Inside a transaction, it's put off until that commits."""
+        if connection.in_atomic_block:
+            # Holding the lock until an outer transaction commits would stall
+            # every other writer, and it couldn't see this one's changes anyway
+            transaction.on_commit(cls.assign_sequences)
+            return 0
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [cls.SEQUENCER_LOCK])
+                cursor.execute("""UPDATE open511_eventchange c SET sequence = n.sequence
+                    FROM (
+                        SELECT id, nextval(%s) AS sequence FROM (
+                            SELECT id FROM open511_eventchange WHERE sequence IS NULL ORDER BY id
+                        ) AS unnumbered
+                    ) AS n
+                    WHERE c.id = n.id""", [cls.SEQUENCE_NAME])
+                count = cursor.rowcount
+                if count and settings.OPEN511_CHANGE_STREAM_BACKEND == 'listen':
+                    # Delivered to listeners when this commits
+                    cursor.execute("SELECT pg_notify(%s, '')", [cls.NOTIFY_CHANNEL])
+        if count:
+            event_changes_recorded.send(sender=cls, count=count)
+        return count
+
+    @classmethod
+    def latest_sequence(cls):
+        """The sequence number of the most recent committed change, or 0."""
+        last = cls.objects.order_by('-sequence').values_list('sequence', flat=True)[:1]
+        return last[0] if last else 0
+
+
+class EventRollup(models.Model):
+    """Counts of published events that started (were created) and ended
+    (were archived) in an hour; maintained by open511_server.analytics."""
+
+    # The area_id under which every event is counted, whatever its areas
+    ALL_AREAS = '*'
+
+    bucket = models.DateTimeField(db_index=True)
+    jurisdiction = models.CharField(max_length=100)
+    area_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50)
+    severity = models.CharField(max_length=50)
+    started = models.IntegerField(default=0)
+    ended = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ('bucket', 'jurisdiction', 'area_id', 'event_type', 'severity')
+        ]
+
+
+class EventFact(models.Model):
+    """What an event currently contributes to the EventRollups, so that
+    can be subtracted when it changes."""
+
+    full_id = models.CharField(max_length=201, primary_key=True)
+    jurisdiction = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50)
+    severity = models.CharField(max_length=50)
+    # Comma-separated area IDs
+    areas = models.TextField(blank=True)
+    started = models.DateTimeField()
+    ended = models.DateTimeField(blank=True, null=True)
+
+
+@receiver(post_delete, sender=RoadEvent)
+def _record_event_deletion(sender, instance, **kwargs):
+    try:
+        full_id = instance.full_id
+    except ObjectDoesNotExist:
+        # The jurisdiction is being deleted too
+        return
+    EventChange.record([EventChange(full_id=full_id, change_type='DELETED', published=instance.published)])
+
+
+@python_2_unicode_compatible
+class Subscription(models.Model):
+    """A partner's standing request to be told, via a webhook, about published
+    events within a geometry (a watched area, or a buffered route)."""
+
+    name = models.CharField(max_length=200)
+    callback_url = models.URLField(max_length=500)
+    # Used to sign deliveries, so the receiver can check they came from us
+    secret = models.CharField(max_length=100, blank=True)
+    geom = models.GeometryField(geography=True)
+    jurisdiction = models.ForeignKey(Jurisdiction, blank=True, null=True, on_delete=models.CASCADE)
+    # Comma-separated; blank means any
+    event_types = models.CharField(max_length=200, blank=True)
+    severities = models.CharField(max_length=200, blank=True)
+    active = models.BooleanField(default=True)
+    # Only changes after this point in the change log are matched
+    start_sequence = models.BigIntegerField(default=0, editable=False)
+    created = models.DateTimeField(default=_now)
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.pk:
+            self.start_sequence = EventChange.latest_sequence()
+        super(Subscription, self).save(*args, **kwargs)
+
+
+class SubscriptionDelivery(models.Model):
+    """A change that matched a subscription, queued to be POSTed to it."""
+
+    STATUSES = [
+        ('PENDING', 'Pending'),
+        ('DELIVERED', 'Delivered'),
+        ('FAILED', 'Failed'),
+        # The event was unpublished before it could be sent
+        ('SKIPPED', 'Skipped'),
+    ]
+
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE)
+    change = models.ForeignKey(EventChange, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=_now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(default=_now)
+
+    class Meta:
+        verbose_name_plural = 'Subscription deliveries'
+        unique_together = [
+            ('subscription', 'change')
+        ]
+        index_together = [
+            ('status', 'next_attempt_at')
+        ]
+
+
 class Camera(_Open511CommonModel):
 
     xml_data = XMLField(default='<camera xmlns:gml="http://www.opengis.net/gml" />')
@@ -571,6 +1112,8 @@ class Camera(_Open511CommonModel):
 
     objects = _Open511CommonManager()
 
+    XML_TAG = 'camera'
+
     FREE_TEXT_TAGS = ['name']
 
     class Meta:
@@ -590,6 +1133,17 @@ class Camera(_Open511CommonModel):
             'id': self.id}
         )
 
+# Which services the discovery view lists depends on whether there are any
+# areas or cameras; see views.discovery.available_services
+DISCOVERY_CACHE_KEY = 'open511_discovery_services'
+
+def _invalidate_discovery_cache(sender, **kwargs):
+    cache.delete(DISCOVERY_CACHE_KEY)
+
+for _model in (Area, Camera):
+    post_save.connect(_invalidate_discovery_cache, sender=_model)
+    post_delete.connect(_invalidate_discovery_cache, sender=_model)
+
 class ImportTaskStatus(_Open511Model):
 
     id = models.CharField(max_length=300, primary_key=True)
@@ -605,34 +1159,101 @@ class ImportTaskStatus(_Open511Model):
         return self.status_info.get('objects_imported', '?')
     admin_num_imported.short_description = '# objs last import'
 
+    def admin_interval(self):
+        return self.status_info.get('interval', '')
+    admin_interval.short_description = 'Polling interval (s)'
 
-class SearchGeometry(object):
-    """A saved geometry object, to be used in searches."""
 
-    DoesNotExist = ObjectDoesNotExist
+@python_2_unicode_compatible
+class SearchGeometry(models.Model):
+    """A saved geometry object, to be used in searches.
 
-    def __init__(self, geom, id):
-        self.id = id
-        self.geom = geom
+    Alongside the original geometry, it stores an ST_Subdivide'd version as
+    SearchGeometryPieces: small, simple pieces with their own spatial index,
+    which are much faster to intersect with than one huge polygon."""
 
-    def save(self):
-        if self.id is None:
-            self.id = hashlib.md5(self.geom.wkt).hexdigest()
-        cache.set('searchgeometry_%s' % self.id, 
-            self.geom, 60*60*24) # FIXME configurable duration
+    id = models.CharField(max_length=32, primary_key=True)
+    geom = models.GeometryField()
+    created = models.DateTimeField(default=_now)
+    # Updated at most every TOUCH_INTERVAL; the prune_search_geometries
+    # command deletes geometries that haven't been used in a while
+    last_used = models.DateTimeField(default=_now, db_index=True)
+
+    objects = models.GeoManager()
+
+    MAX_VERTICES_PER_PIECE = 64
+    TOUCH_INTERVAL = datetime.timedelta(hours=1)
+
+    # Recently used geometries, least recently used first, keyed by the
+    # string they were parsed from, as (SearchGeometry, time memoized)
+    _memo = OrderedDict()
+    _memo_lock = threading.Lock()
+    MAX_MEMOIZED = 1000
+
+    class Meta:
+        verbose_name = _('Search geometry')
+        verbose_name_plural = _('Search geometries')
+
+    def __str__(self):
+        return self.id
+
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.id = hashlib.md5(self.geom.wkt.encode('ascii')).hexdigest()
+        if not self.geom.srid:
+            self.geom.srid = 4326
+        with transaction.atomic():
+            super(SearchGeometry, self).save(*args, **kwargs)
+            self.pieces.all().delete()
+            cursor = connection.cursor()
+            cursor.execute(
+                "INSERT INTO {0} (search_geometry_id, geom) "
+                "SELECT %s, ST_Subdivide(geom, %s)::geography FROM {1} WHERE id = %s".format(
+                    SearchGeometryPiece._meta.db_table, self._meta.db_table),
+                [self.id, self.MAX_VERTICES_PER_PIECE, self.id])
 
     @staticmethod
     def get(key):
-        obj = cache.get('searchgeometry_%s' % key)
-        if obj is None:
-            raise SearchGeometry.DoesNotExist
-        else:
-            return SearchGeometry(obj, id=key)
+        return SearchGeometry.objects.get(id=key)
 
     @classmethod
     def fromstring(cls, input):
+        """Returns a saved SearchGeometry from either its ID or a geometry string."""
+        now = _now()
+        with cls._memo_lock:
+            memoized = cls._memo.pop(input, None)
+            if memoized is not None and now - memoized[1] < cls.TOUCH_INTERVAL:
+                cls._memo[input] = memoized
+                return memoized[0]
+
         if is_hex(input):
             # Looks like an ID
-            return cls.get(input)
-        geom = geos_geom_from_string(input)
-        return cls(geom, id=None)
+            obj = cls.get(input)
+        else:
+            geom = geos_geom_from_string(input)
+            if not geom.srid:
+                geom.srid = 4326
+            obj = cls(geom=geom)
+            obj.id = hashlib.md5(geom.wkt.encode('ascii')).hexdigest()
+            if not cls.objects.filter(id=obj.id).exists():
+                try:
+                    obj.save(force_insert=True)
+                except IntegrityError:
+                    # Another request saved the same geometry first
+                    obj = cls.get(obj.id)
+        cls.objects.filter(id=obj.id, last_used__lt=now - cls.TOUCH_INTERVAL).update(last_used=now)
+
+        with cls._memo_lock:
+            cls._memo[input] = (obj, now)
+            while len(cls._memo) > cls.MAX_MEMOIZED:
+                cls._memo.popitem(last=False)
+        return obj
+
+
+class SearchGeometryPiece(models.Model):
+    """A subdivided piece of a SearchGeometry."""
+
+    search_geometry = models.ForeignKey(SearchGeometry, related_name='pieces', on_delete=models.CASCADE)
+    geom = models.GeometryField(geography=True)
+
+    objects = models.GeoManager()
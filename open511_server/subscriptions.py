@@ -0,0 +1,233 @@
+"""Webhook notifications for Subscriptions.
+
+match_subscriptions() finds, in one query, every subscription matching any
+change logged since it last ran, and queues a SubscriptionDelivery for each.
+Imports and API writes run it, via match_subscriptions_on_commit(), once
+their transactions have committed; the deliver_subscriptions worker also
+runs it periodically. A DeliveryWorkerPool then POSTs the queued
+deliveries, retrying failures with exponential backoff."""
+
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+
+from django.db import close_old_connections, connection, transaction
+
+from lxml.builder import E
+import requests
+
+from open511.converter import xml_to_json
+from open511.utils.serialization import get_base_open511_element
+
+from open511_server.conf import settings
+from open511_server.models import (EventChange, ImportTaskStatus, RoadEvent,
+    SubscriptionDelivery, _now)
+
+logger = logging.getLogger(__name__)
+
+MATCHER_STATUS_ID = 'subscription matcher'
+
+_MATCH_SQL = """INSERT INTO open511_subscriptiondelivery
+        (subscription_id, change_id, status, attempts, next_attempt_at, last_error, created)
+    SELECT s.id, c.id, 'PENDING', 0, now(), '', now()
+    FROM open511_eventchange c
+    JOIN open511_jurisdiction jur ON jur.id = split_part(c.full_id, '/', 1)
+    JOIN open511_roadevent t ON t.jurisdiction_id = jur.internal_id
+        AND t.id = substr(c.full_id, length(jur.id) + 2)
+    JOIN open511_subscription s ON s.active
+        AND c.sequence > s.start_sequence
+        AND (s.jurisdiction_id IS NULL OR s.jurisdiction_id = jur.internal_id)
+        AND (s.event_types = '' OR (xpath('event_type/text()', t.xml_data))[1]::text
+            = ANY(string_to_array(s.event_types, ',')))
+        AND (s.severities = '' OR (xpath('severity/text()', t.xml_data))[1]::text
+            = ANY(string_to_array(s.severities, ',')))
+        AND ST_Intersects(s.geom, t.geom)
+    WHERE c.sequence > %(since)s AND c.sequence <= %(until)s
+        AND c.published AND c.change_type <> 'DELETED'
+    UNION
+    -- Deleted events have no geometry left to match, so their tombstones go
+    -- to the subscriptions that were told about the event before
+    SELECT d.subscription_id, c.id, 'PENDING', 0, now(), '', now()
+    FROM open511_eventchange c
+    JOIN open511_eventchange prev ON prev.full_id = c.full_id AND prev.sequence < c.sequence
+    JOIN open511_subscriptiondelivery d ON d.change_id = prev.id
+    JOIN open511_subscription s ON s.id = d.subscription_id AND s.active
+    WHERE c.sequence > %(since)s AND c.sequence <= %(until)s
+        AND c.published AND c.change_type = 'DELETED'
+    ON CONFLICT DO NOTHING"""
+
+
+def match_subscriptions():
+    """Queues deliveries for all changes logged since the last call.
+    Returns the number of deliveries queued, or None if another process
+    is already matching."""
+    EventChange.assign_sequences()
+    with transaction.atomic():
+        ImportTaskStatus.objects.get_or_create(id=MATCHER_STATUS_ID)
+    with transaction.atomic():
+        status = ImportTaskStatus.objects.select_for_update(skip_locked=True).filter(
+            id=MATCHER_STATUS_ID).first()
+        if status is None:
+            # Whatever it doesn't get to, the next run will
+            return None
+        since = status.status_info.get('last_sequence', 0)
+        # Sequence numbers are only given to committed changes, in commit
+        # order, so nothing can later turn up at or below this
+        until = EventChange.latest_sequence()
+        if until <= since:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(_MATCH_SQL, {'since': since, 'until': until})
+            queued = cursor.rowcount
+        status.status_info['last_sequence'] = until
+        status.save()
+    if queued:
+        logger.info("Queued %s subscription deliveries" % queued)
+    return queued
+
+
+def _match_subscriptions_logging_errors():
+    try:
+        match_subscriptions()
+    except Exception:
+        logger.exception("Error matching subscriptions")
+
+
+def match_subscriptions_on_commit():
+    """Runs match_subscriptions once the current transaction, if any, has
+    committed. Errors are logged rather than raised, so they can't fail
+    the write that led to the matching."""
+    transaction.on_commit(_match_subscriptions_logging_errors)
+
+
+def delivery_payload(delivery):
+    """The JSON-ready body to POST for a delivery, or None if the event is
+    no longer published, and so shouldn't be sent at all."""
+    change = delivery.change
+    payload = {
+        'subscription': delivery.subscription.name,
+        'change': {
+            'sequence': change.sequence,
+            'event_id': change.full_id,
+            'change_type': change.change_type,
+            'timestamp': change.created.isoformat(),
+        }
+    }
+    if change.change_type != 'DELETED':
+        jurisdiction_id, _, event_id = change.full_id.partition('/')
+        try:
+            rdev = RoadEvent.objects.get(jurisdiction__id=jurisdiction_id, id=event_id, published=True)
+        except RoadEvent.DoesNotExist:
+            if RoadEvent.objects.filter(jurisdiction__id=jurisdiction_id, id=event_id).exists():
+                # Unpublished since the change was matched
+                return None
+        else:
+            base = get_base_open511_element(base=settings.OPEN511_BASE_URL)
+            base.append(E.events(rdev.to_full_xml_element(remove_internal_elements=True)))
+            payload['event'] = xml_to_json(base)['events'][0]
+    return payload
+
+
+class DeliveryWorkerPool(object):
+    """A fixed number of workers POSTing queued deliveries to subscribers.
+
+    Each worker claims one due delivery at a time, leasing it so other
+    workers (in this process or others) skip it."""
+
+    TIMEOUT = 10
+    MAX_ATTEMPTS = 8
+    # Seconds before the first retry; doubles with each further attempt
+    RETRY_DELAY = 30
+    MAX_RETRY_DELAY = 6 * 60 * 60
+    # How long a claimed delivery is left alone before it's considered abandoned
+    LEASE = 120
+
+    def __init__(self, workers=4):
+        self.workers = workers
+
+    def run(self, once=False, poll_interval=10):
+        """Starts the workers. With once=True, returns when there's nothing
+        left that's due; otherwise, runs forever, also matching subscriptions
+        every poll_interval seconds to pick up anything writers didn't."""
+        threads = [threading.Thread(target=self._work, args=(once, poll_interval))
+            for i in range(self.workers)]
+        if not once:
+            threads.append(threading.Thread(target=self._match, args=(poll_interval,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _work(self, once, poll_interval):
+        try:
+            while True:
+                delivery = self.claim()
+                if delivery:
+                    self.deliver(delivery)
+                elif once:
+                    return
+                else:
+                    time.sleep(poll_interval)
+        finally:
+            connection.close()
+
+    def _match(self, poll_interval):
+        try:
+            while True:
+                _match_subscriptions_logging_errors()
+                close_old_connections()
+                time.sleep(poll_interval)
+        finally:
+            connection.close()
+
+    def claim(self):
+        now = _now()
+        with transaction.atomic():
+            delivery = (SubscriptionDelivery.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='PENDING', next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'id')
+                .select_related('subscription', 'change')
+                .first())
+            if delivery:
+                SubscriptionDelivery.objects.filter(id=delivery.id).update(
+                    next_attempt_at=now + datetime.timedelta(seconds=self.LEASE))
+        return delivery
+
+    def deliver(self, delivery):
+        subscription = delivery.subscription
+        payload = delivery_payload(delivery)
+        if payload is None:
+            delivery.status = 'SKIPPED'
+            delivery.save(update_fields=['status'])
+            return False
+        body = json.dumps(payload).encode('utf8')
+        headers = {'Content-Type': 'application/json'}
+        if subscription.secret:
+            headers['Open511-Signature'] = 'sha256=' + hmac.new(
+                subscription.secret.encode('utf8'), body, hashlib.sha256).hexdigest()
+
+        delivery.attempts += 1
+        try:
+            resp = requests.post(subscription.callback_url, data=body, headers=headers,
+                timeout=self.TIMEOUT)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            delivery.last_error = u'%s: %s' % (e.__class__.__name__, e)
+            if delivery.attempts >= self.MAX_ATTEMPTS:
+                delivery.status = 'FAILED'
+                logger.warning("Giving up on delivery %s to %s: %s" % (
+                    delivery.id, subscription.callback_url, delivery.last_error))
+            else:
+                delay = min(self.RETRY_DELAY * 2 ** (delivery.attempts - 1), self.MAX_RETRY_DELAY)
+                delivery.next_attempt_at = _now() + datetime.timedelta(seconds=delay)
+        else:
+            delivery.status = 'DELIVERED'
+            delivery.last_error = ''
+        delivery.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
+        return delivery.status == 'DELIVERED'
@@ -15,7 +15,13 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_TASK_OPTS = {
     'INTERVAL': 600,
+    # If both MIN_INTERVAL and MAX_INTERVAL are set, the interval adapts
+    # to how often the feed changes, within those bounds
+    'MIN_INTERVAL': None,
+    'MAX_INTERVAL': None,
     'TIMEOUT': 120,
+    # Label imported events with the local auto-label Areas they fall within
+    'AUTO_LABEL_AREAS': False,
     'IMPORTER': 'open511_server.importer.Open511Importer'
 }
 
@@ -27,6 +33,7 @@ def run_task(task_def):
     timeout = gevent.Timeout(task_def['TIMEOUT'])
     try:
         importer.run()
+        return importer.interval
     except Exception as e:
         logger.exception("{} running task {}".format(e.__class__.__name__, importer.id))
     finally:
@@ -40,7 +47,7 @@ def task_complete(task_def, greenlet):
     if greenlet.exception:
         logger.error("{} running task {}: e".format(greenlet.exception.__class__.__name__, task_def.get('URL'),
             greenlet.exception))
-    gevent.sleep(task_def['INTERVAL'])
+    gevent.sleep(greenlet.value or task_def['INTERVAL'])
     spawn_task(task_def)
 
 def run_forever():
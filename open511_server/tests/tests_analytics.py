@@ -0,0 +1,65 @@
+import datetime
+
+from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase
+from lxml import etree
+
+from open511_server.analytics import update_rollups
+from open511_server.models import EventFact, RoadEvent, _now
+from open511_server.tests.utils import load_events
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+
+class RollupTestCase(TransactionTestCase):
+    # update_rollups reads the change log, whose entries are only numbered
+    # once they've committed
+
+    def setUp(self):
+        execute_test_endpoint_command('clear')
+
+    def get_rollups(self, **params):
+        now = _now()
+        params.update({
+            'format': 'xml',
+            'start': (now - datetime.timedelta(days=1)).isoformat(),
+            'end': (now + datetime.timedelta(days=1)).isoformat(),
+            'interval': 'month',
+        })
+        resp = self.client.get(reverse('open511_event_rollups'), params)
+        self.assertEqual(resp.status_code, 200)
+        doc = etree.fromstring(resp.content)
+        return [dict((el.tag, el.text) for el in rollup) for rollup in doc.xpath('//rollup')]
+
+    def test_started_and_ended(self):
+        load_events({'id': '1', 'pos': '45.5 -73.6'}, {'id': '2', 'pos': '45.4 -73.5'})
+        # The report doesn't update the rollups itself
+        self.assertEqual(self.get_rollups(), [])
+
+        self.assertEqual(update_rollups(), 2)
+        rollups = self.get_rollups(group_by='event_type')
+        self.assertEqual(len(rollups), 1)
+        self.assertEqual(rollups[0]['event_type'], 'CONSTRUCTION')
+        self.assertEqual(rollups[0]['events_started'], '2')
+        self.assertEqual(rollups[0]['events_ended'], '0')
+
+        RoadEvent.objects.update_and_record(RoadEvent.objects.filter(id='1'), 'ARCHIVED', active=False)
+        self.assertEqual(update_rollups(), 1)
+        rollups = self.get_rollups()
+        self.assertEqual(rollups[0]['events_started'], '2')
+        self.assertEqual(rollups[0]['events_ended'], '1')
+
+        # Nothing new
+        self.assertEqual(update_rollups(), 0)
+
+    def test_end_time_stable_across_saves(self):
+        load_events({'id': '1', 'pos': '45.5 -73.6'})
+        ended = _now() - datetime.timedelta(hours=3)
+        RoadEvent.objects.update_and_record(RoadEvent.objects.all(), 'UPDATED', active=False, updated=ended)
+        update_rollups()
+        self.assertEqual(EventFact.objects.get().ended, ended)
+
+        # Saving the archived event again doesn't move its end time
+        RoadEvent.objects.update_and_record(RoadEvent.objects.all(), 'UPDATED')
+        update_rollups()
+        self.assertEqual(EventFact.objects.get().ended, ended)
+        self.assertEqual(sum(int(r['events_ended']) for r in self.get_rollups()), 1)
@@ -0,0 +1,90 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from lxml import etree
+
+from open511_server.models import Jurisdiction, RoadEvent
+from open511_server.tests.utils import load_events
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+NEW_EVENT = {
+    'status': 'ACTIVE',
+    'headline': 'New',
+    'event_type': 'CONSTRUCTION',
+    'severity': 'MINOR',
+    'geography': {'type': 'Point', 'coordinates': [-73.6, 45.5]},
+    'schedule': {'intervals': ['2014-01-01T00:00/2099-01-01T00:00']},
+}
+
+
+class BatchTestCase(TestCase):
+
+    def setUp(self):
+        execute_test_endpoint_command('clear')
+        load_events({'id': '1', 'pos': '45.5 -73.6'}, {'id': '2', 'pos': '45.4 -73.5'})
+        user = User.objects.create_user('editor', password='editor')
+        Jurisdiction.objects.get(id='test.open511.org').permitted_users.add(user)
+        self.client.login(username='editor', password='editor')
+
+    def post_batch(self, operations):
+        resp = self.client.post(reverse('open511_roadevent_batch') + '?format=xml',
+            json.dumps({'operations': operations}), content_type='application/json')
+        results = etree.fromstring(resp.content).xpath('results/result')
+        return resp.status_code, [
+            (r.findtext('op'), r.findtext('status'), r.findtext('id')) for r in results]
+
+    def headline(self, id):
+        return RoadEvent.objects.get(id=id).xml_elem.findtext('headline')
+
+    def test_all_applied(self):
+        status, results = self.post_batch([
+            {'op': 'create', 'jurisdiction_id': 'test.open511.org', 'data': NEW_EVENT},
+            {'op': 'patch', 'id': 'test.open511.org/1', 'data': {'headline': 'Patched'}},
+            {'op': 'delete', 'id': 'test.open511.org/2'},
+        ])
+        self.assertEqual(status, 200)
+        created = RoadEvent.objects.exclude(id='1').get()
+        self.assertEqual(results, [
+            ('create', 'created', created.full_id),
+            ('patch', 'updated', 'test.open511.org/1'),
+            ('delete', 'deleted', 'test.open511.org/2'),
+        ])
+        self.assertEqual(created.xml_elem.findtext('headline'), 'New')
+        self.assertEqual(self.headline('1'), 'Patched')
+
+    def test_one_failure_rolls_back_all(self):
+        status, results = self.post_batch([
+            {'op': 'create', 'jurisdiction_id': 'test.open511.org', 'data': NEW_EVENT},
+            {'op': 'patch', 'id': 'test.open511.org/1', 'data': {'headline': 'Patched'}},
+            {'op': 'patch', 'id': 'test.open511.org/nonexistent', 'data': {'headline': 'Patched'}},
+            {'op': 'delete', 'id': 'test.open511.org/2'},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual([(op, status) for op, status, id in results], [
+            ('create', 'not_applied'),
+            ('patch', 'not_applied'),
+            ('patch', 'error'),
+            ('delete', 'not_applied'),
+        ])
+        self.assertEqual(sorted(RoadEvent.objects.values_list('id', flat=True)), ['1', '2'])
+        self.assertEqual(self.headline('1'), '1')
+
+    def test_invalid_event_fails_batch(self):
+        status, results = self.post_batch([
+            {'op': 'patch', 'id': 'test.open511.org/1', 'data': {'headline': 'Patched'}},
+            {'op': 'patch', 'id': 'test.open511.org/2', 'data': {'severity': 'APOCALYPTIC'}},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual([status for op, status, id in results], ['not_applied', 'error'])
+        self.assertEqual(self.headline('1'), '1')
+
+    def test_permission_needed(self):
+        Jurisdiction.objects.get(id='test.open511.org').permitted_users.clear()
+        status, results = self.post_batch([
+            {'op': 'delete', 'id': 'test.open511.org/1'},
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual(results[0][1], 'error')
+        self.assertEqual(RoadEvent.objects.count(), 2)
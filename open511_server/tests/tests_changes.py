@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from lxml import etree
+
+from open511_server.models import EventChange
+from open511_server.views.changes import ChangeStreamView
+
+
+def record(full_id, change_type='CREATED'):
+    EventChange.record([EventChange(full_id=full_id, change_type=change_type)])
+
+
+class ChangeLogTestCase(TransactionTestCase):
+    # Sequence numbers are given out as transactions commit, so these tests
+    # can't run inside one test-wide transaction
+
+    def get_changes(self, **params):
+        params['format'] = 'json'
+        resp = self.client.get(reverse('open511_change_list'), params)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.content.decode('utf8'))['changes']
+
+    def test_late_commit_not_skipped(self):
+        inserted = threading.Event()
+        release = threading.Event()
+
+        def slow_writer():
+            try:
+                with transaction.atomic():
+                    record('test.open511.org/slow')
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=slow_writer)
+        thread.start()
+        self.assertTrue(inserted.wait(10))
+
+        # Inserted after the slow writer's change, but committed first
+        record('test.open511.org/fast')
+        changes = self.get_changes()
+        self.assertEqual([c['event_id'] for c in changes], ['test.open511.org/fast'])
+        cursor = changes[-1]['sequence']
+
+        release.set()
+        thread.join(10)
+
+        changes = self.get_changes(since=cursor)
+        self.assertEqual([c['event_id'] for c in changes], ['test.open511.org/slow'])
+        self.assertTrue(changes[0]['sequence'] > cursor)
+
+    def test_since_paging(self):
+        for i in range(5):
+            record('test.open511.org/%s' % i)
+        record('test.open511.org/0', change_type='UPDATED')
+
+        seen = []
+        url = reverse('open511_change_list') + '?format=xml&limit=2'
+        for page in range(10):
+            doc = etree.fromstring(self.client.get(url).content)
+            seen.extend((change.findtext('event_id'), change.findtext('change_type'))
+                for change in doc.xpath('changes/change'))
+            url = doc.xpath('pagination/link[@rel="next"]/@href')[0]
+            if doc.xpath('pagination/caught_up'):
+                break
+        self.assertEqual(seen, [('test.open511.org/%s' % i, 'CREATED') for i in range(5)]
+            + [('test.open511.org/0', 'UPDATED')])
+
+        # The last next link is where to pick up from later
+        self.assertEqual(etree.fromstring(self.client.get(url).content).xpath('changes/change'), [])
+        record('test.open511.org/5')
+        doc = etree.fromstring(self.client.get(url).content)
+        self.assertEqual(doc.xpath('changes/change/event_id/text()'), ['test.open511.org/5'])
+
+    def test_unpublished_changes_hidden(self):
+        EventChange.record([EventChange(full_id='test.open511.org/1', change_type='CREATED', published=False)])
+        record('test.open511.org/2')
+        self.assertEqual([c['event_id'] for c in self.get_changes()], ['test.open511.org/2'])
+
+    def test_uncommitted_changes_unnumbered(self):
+        with transaction.atomic():
+            record('test.open511.org/1')
+            self.assertEqual(EventChange.objects.get().sequence, None)
+            self.assertEqual(EventChange.latest_sequence(), 0)
+        self.assertEqual(EventChange.objects.get().sequence, EventChange.latest_sequence())
+
+
+def record_later(full_id, delay=0.5):
+    def target():
+        time.sleep(delay)
+        try:
+            record(full_id)
+        finally:
+            connection.close()
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+@override_settings(OPEN511_CHANGE_STREAM_BACKEND='local')
+class ChangeNotificationTestCase(TransactionTestCase):
+
+    def test_long_poll(self):
+        record('test.open511.org/1')
+        url = reverse('open511_change_list')
+        changes = json.loads(self.client.get(url, {'format': 'json'}).content.decode('utf8'))['changes']
+        since = changes[-1]['sequence']
+
+        thread = record_later('test.open511.org/2')
+        started = time.time()
+        resp = self.client.get(url, {'format': 'json', 'since': since, 'wait': 10})
+        thread.join()
+        self.assertTrue(time.time() - started < 10)
+        changes = json.loads(resp.content.decode('utf8'))['changes']
+        self.assertEqual([c['event_id'] for c in changes], ['test.open511.org/2'])
+
+    def test_long_poll_times_out(self):
+        resp = self.client.get(reverse('open511_change_list'),
+            {'format': 'json', 'since': EventChange.latest_sequence(), 'wait': 0.5})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode('utf8'))['changes'], [])
+
+    def test_stream_backlog_then_live(self):
+        record('test.open511.org/1')
+        record('test.open511.org/2')
+        first = EventChange.objects.get(full_id='test.open511.org/1').sequence
+
+        resp = self.client.get(reverse('open511_change_stream'), HTTP_ACCEPT='text/event-stream',
+            HTTP_LAST_EVENT_ID=str(first))
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        stream = iter(resp.streaming_content)
+        try:
+            self.assertTrue(next(stream).startswith(b'retry:'))
+            # Only what came after Last-Event-ID
+            backlog = next(stream).decode('utf8')
+            self.assertIn('"event_id": "test.open511.org/2"', backlog)
+
+            thread = record_later('test.open511.org/3')
+            live = next(stream).decode('utf8')
+            while live.startswith(':'):
+                # A keepalive
+                live = next(stream).decode('utf8')
+            thread.join()
+            sequence = EventChange.objects.get(full_id='test.open511.org/3').sequence
+            self.assertTrue(live.startswith('id: %d\nevent: created\n' % sequence))
+        finally:
+            resp.close()
+
+    def test_stream_backlog_skips_unmatched_pages(self):
+        for i in range(3):
+            record('other.open511.org/%s' % i)
+        record('test.open511.org/1')
+
+        page_size = ChangeStreamView.BACKLOG_PAGE_SIZE
+        ChangeStreamView.BACKLOG_PAGE_SIZE = 2
+        try:
+            resp = self.client.get(reverse('open511_change_stream'), {'jurisdiction': 'test.open511.org'},
+                HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID='0')
+            stream = iter(resp.streaming_content)
+            try:
+                self.assertTrue(next(stream).startswith(b'retry:'))
+                # The first page is all other jurisdictions' changes
+                backlog = next(stream).decode('utf8')
+                self.assertIn('"event_id": "test.open511.org/1"', backlog)
+            finally:
+                resp.close()
+        finally:
+            ChangeStreamView.BACKLOG_PAGE_SIZE = page_size
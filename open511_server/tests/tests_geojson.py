@@ -0,0 +1,81 @@
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+EVENTS_XML = """<open511 xml:lang="en" xmlns:gml="http://www.opengis.net/gml" version="v1">
+    <events>
+        <event>
+            <id>test.open511.org/geojson1</id>
+            <status>ACTIVE</status>
+            <headline>Bridge closed</headline>
+            <event_type>CONSTRUCTION</event_type>
+            <severity>MAJOR</severity>
+            <geography>
+                <gml:LineString srsName="urn:ogc:def:crs:EPSG::4326">
+                    <gml:posList>45.5 -73.6 45.5123456 -73.6123456 45.52 -73.63</gml:posList>
+                </gml:LineString>
+            </geography>
+            <schedule><intervals><interval>2014-01-01T00:00/2099-01-01T00:00</interval></intervals></schedule>
+        </event>
+        <event>
+            <id>test.open511.org/geojson2</id>
+            <status>ACTIVE</status>
+            <headline>Lane closed</headline>
+            <event_type>INCIDENT</event_type>
+            <severity>MINOR</severity>
+            <geography>
+                <gml:Point srsName="urn:ogc:def:crs:EPSG::4326">
+                    <gml:pos>45.4 -73.5</gml:pos>
+                </gml:Point>
+            </geography>
+            <schedule><intervals><interval>2014-01-01T00:00/2099-01-01T00:00</interval></intervals></schedule>
+        </event>
+    </events>
+</open511>"""
+
+
+def _flatten_coords(coords):
+    if isinstance(coords[0], (list, tuple)):
+        return [c for sub in coords for c in _flatten_coords(sub)]
+    return list(coords)
+
+
+class GeoJSONOutputTestCase(TestCase):
+
+    def setUp(self):
+        execute_test_endpoint_command('clear')
+        execute_test_endpoint_command('load', xml=EVENTS_XML)
+
+    def test_geojson_matches_json(self):
+        url = reverse('open511_roadevent_list')
+        json_resp = self.client.get(url, {'format': 'json'})
+        geojson_resp = self.client.get(url, {'format': 'geojson'})
+        self.assertEqual(geojson_resp.status_code, 200)
+        self.assertEqual(geojson_resp['Content-Type'], 'application/geo+json')
+
+        events = json.loads(json_resp.content.decode('utf8'))['events']
+        collection = json.loads(geojson_resp.content.decode('utf8'))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        features = collection['features']
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual([e['id'] for e in events], [f['id'] for f in features])
+        for event, feature in zip(events, features):
+            self.assertEqual(event['geography']['type'], feature['geometry']['type'])
+            json_coords = _flatten_coords(event['geography']['coordinates'])
+            geojson_coords = _flatten_coords(feature['geometry']['coordinates'])
+            self.assertEqual(len(json_coords), len(geojson_coords))
+            for a, b in zip(json_coords, geojson_coords):
+                self.assertAlmostEqual(a, b, places=6)
+            self.assertEqual(event['severity'], feature['properties']['severity'])
+            self.assertEqual(event['event_type'], feature['properties']['event_type'])
+            self.assertEqual(event['headline'], feature['properties']['headline'])
+
+    def test_geojson_pagination(self):
+        resp = self.client.get(reverse('open511_roadevent_list'), {'format': 'geojson', 'limit': 1})
+        collection = json.loads(resp.content.decode('utf8'))
+        self.assertEqual(len(collection['features']), 1)
+        self.assertTrue(collection['pagination']['next_url'])
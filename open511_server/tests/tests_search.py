@@ -0,0 +1,50 @@
+from django.contrib.admin.sites import AdminSite
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from lxml import etree
+
+from open511_server.admin import RoadEventAdmin
+from open511_server.models import RoadEvent
+from open511_server.tests.utils import load_events
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        execute_test_endpoint_command('clear')
+        load_events(
+            {'id': '1', 'headline': 'Bridge closures', 'description': 'Lanes reduced overnight',
+                'road': 'Rue Sherbrooke'},
+            {'id': '2', 'headline': 'Lane reduction', 'description': 'Work near the bridge',
+                'road': 'Avenue du Parc'},
+            {'id': '3', 'headline': 'Water main repair', 'description': 'Sidewalk closed',
+                'road': 'Boulevard Saint-Laurent'},
+        )
+
+    def search(self, q):
+        resp = self.client.get(reverse('open511_roadevent_list'), {'q': q, 'format': 'xml'})
+        self.assertEqual(resp.status_code, 200)
+        return [id.split('/')[-1] for id in etree.fromstring(resp.content).xpath('events/event/id/text()')]
+
+    def test_stemmed_words(self):
+        # 'closures' in the headline is stemmed, as is the query
+        self.assertEqual(self.search('closure'), ['1'])
+        self.assertEqual(self.search('repairs'), ['3'])
+
+    def test_headline_ranks_above_description(self):
+        self.assertEqual(self.search('bridge'), ['1', '2'])
+
+    def test_fuzzy_road_names(self):
+        self.assertEqual(self.search('sherbrook'), ['1'])
+
+    def test_no_match(self):
+        self.assertEqual(self.search('snowplow'), [])
+
+    def test_admin_search(self):
+        admin = RoadEventAdmin(RoadEvent, AdminSite())
+        qs, may_have_duplicates = admin.get_search_results(None, RoadEvent.objects.all(), 'water')
+        self.assertEqual([rdev.id for rdev in qs], ['3'])
+        # Exact IDs still work
+        qs, may_have_duplicates = admin.get_search_results(None, RoadEvent.objects.all(), '2')
+        self.assertEqual([rdev.id for rdev in qs], ['2'])
@@ -0,0 +1,154 @@
+import datetime
+import hashlib
+import hmac
+import json
+import threading
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import TransactionTestCase
+
+from open511_server.models import RoadEvent, Subscription, SubscriptionDelivery, _now
+from open511_server.subscriptions import DeliveryWorkerPool, match_subscriptions
+from open511_server.tests.utils import load_events
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+
+class WebhookReceiver(object):
+    """A local stand-in for a partner's webhook endpoint. Responds with
+    the given status codes in turn, then 200s."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((dict(self.headers.items()), body))
+                self.send_response(receiver.statuses.pop(0) if receiver.statuses else 200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/hook' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def payloads(self):
+        return [json.loads(body.decode('utf8')) for headers, body in self.requests]
+
+
+class SubscriptionTestCase(TransactionTestCase):
+    # Changes are only numbered, and so matched, once they've committed
+
+    def setUp(self):
+        execute_test_endpoint_command('clear')
+        self.receiver = WebhookReceiver()
+        self.subscription = Subscription.objects.create(
+            name='Montreal partner',
+            callback_url=self.receiver.url,
+            secret='sekrit',
+            geom=GEOSGeometry('POLYGON((-73.7 45.45, -73.55 45.45, -73.55 45.55, -73.7 45.55, -73.7 45.45))', srid=4326)
+        )
+        self.pool = DeliveryWorkerPool(workers=1)
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def deliver_due(self):
+        # Deliver in this thread, so the test knows when it's done
+        while True:
+            delivery = self.pool.claim()
+            if not delivery:
+                break
+            self.pool.deliver(delivery)
+
+    def test_matching_event_delivered(self):
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'}, {'id': 'outside', 'pos': '45.4 -73.5'})
+        self.assertEqual(match_subscriptions(), 1)
+        # Nothing new to match
+        self.assertEqual(match_subscriptions(), 0)
+
+        self.deliver_due()
+        self.assertEqual(len(self.receiver.requests), 1)
+        headers, body = self.receiver.requests[0]
+        payload = self.receiver.payloads[0]
+        self.assertEqual(payload['change']['event_id'], 'test.open511.org/inside')
+        self.assertEqual(payload['change']['change_type'], 'CREATED')
+        self.assertEqual(payload['event']['headline'], 'inside')
+        signature = dict((k.lower(), v) for k, v in headers.items())['open511-signature']
+        self.assertEqual(signature, 'sha256=' + hmac.new(b'sekrit', body, hashlib.sha256).hexdigest())
+        self.assertEqual(SubscriptionDelivery.objects.get().status, 'DELIVERED')
+
+    def test_filters(self):
+        self.subscription.severities = 'MINOR,MODERATE'
+        self.subscription.save()
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'})
+        self.assertEqual(match_subscriptions(), 0)
+
+    def test_failed_delivery_retried(self):
+        self.receiver.statuses = [500]
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'})
+        match_subscriptions()
+
+        self.deliver_due()
+        delivery = SubscriptionDelivery.objects.get()
+        self.assertEqual(delivery.status, 'PENDING')
+        self.assertEqual(delivery.attempts, 1)
+        self.assertTrue(delivery.next_attempt_at > _now())
+        self.assertIn('500', delivery.last_error)
+
+        # Not due yet
+        self.deliver_due()
+        self.assertEqual(len(self.receiver.requests), 1)
+
+        SubscriptionDelivery.objects.update(next_attempt_at=_now() - datetime.timedelta(seconds=1))
+        self.deliver_due()
+        delivery = SubscriptionDelivery.objects.get()
+        self.assertEqual(delivery.status, 'DELIVERED')
+        self.assertEqual(delivery.attempts, 2)
+        self.assertEqual(len(self.receiver.requests), 2)
+
+    def test_gives_up(self):
+        self.receiver.statuses = [500] * DeliveryWorkerPool.MAX_ATTEMPTS
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'})
+        match_subscriptions()
+        for i in range(DeliveryWorkerPool.MAX_ATTEMPTS):
+            SubscriptionDelivery.objects.update(next_attempt_at=_now() - datetime.timedelta(seconds=1))
+            self.deliver_due()
+        self.assertEqual(SubscriptionDelivery.objects.get().status, 'FAILED')
+        self.assertEqual(len(self.receiver.requests), DeliveryWorkerPool.MAX_ATTEMPTS)
+
+    def test_deletion_sent_to_previous_recipients(self):
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'}, {'id': 'outside', 'pos': '45.4 -73.5'})
+        match_subscriptions()
+        RoadEvent.objects.all().delete()
+        self.assertEqual(match_subscriptions(), 1)
+
+        self.deliver_due()
+        deleted = [p for p in self.receiver.payloads if p['change']['change_type'] == 'DELETED']
+        self.assertEqual(len(deleted), 1)
+        self.assertEqual(deleted[0]['change']['event_id'], 'test.open511.org/inside')
+        self.assertNotIn('event', deleted[0])
+
+    def test_unpublished_event_skipped(self):
+        load_events({'id': 'inside', 'pos': '45.5 -73.6'})
+        match_subscriptions()
+        RoadEvent.objects.update(published=False)
+
+        self.deliver_due()
+        self.assertEqual(self.receiver.requests, [])
+        self.assertEqual(SubscriptionDelivery.objects.get().status, 'SKIPPED')
@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase
+from lxml import etree
+
+from open511_server.models import Jurisdiction, RoadEvent
+from open511_server.tests.utils import load_events
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+
+class SummaryTestCase(TransactionTestCase):
+    # The cache key includes the latest change sequence number, which is
+    # only handed out once a change has committed
+
+    def setUp(self):
+        cache.clear()
+        execute_test_endpoint_command('clear')
+        load_events({'id': '1'}, {'id': '2'}, {'id': '3', 'event_type': 'INCIDENT', 'severity': 'MINOR'})
+
+    def get_summary(self, **params):
+        params['format'] = 'xml'
+        resp = self.client.get(reverse('open511_roadevent_summary'), params)
+        self.assertEqual(resp.status_code, 200)
+        return etree.fromstring(resp.content).find('summary')
+
+    def counts(self, summary, facet):
+        return [(el.findtext(facet), int(el.findtext('count')))
+            for el in summary.findall('%s_counts/%s_count' % (facet, facet))]
+
+    def test_facets(self):
+        summary = self.get_summary()
+        self.assertEqual(summary.findtext('total'), '3')
+        self.assertEqual(self.counts(summary, 'severity'), [('MAJOR', 2), ('MINOR', 1)])
+        self.assertEqual(self.counts(summary, 'event_type'), [('CONSTRUCTION', 2), ('INCIDENT', 1)])
+        self.assertEqual(self.counts(summary, 'jurisdiction'), [('test.open511.org', 3)])
+        self.assertEqual(self.counts(summary, 'area'), [])
+
+    def test_selected_facets_and_filters(self):
+        summary = self.get_summary(facets='severity', event_type='CONSTRUCTION')
+        self.assertEqual(summary.findtext('total'), '2')
+        self.assertEqual(self.counts(summary, 'severity'), [('MAJOR', 2)])
+        self.assertEqual(summary.find('event_type_counts'), None)
+
+    def test_changes_invalidate_cache(self):
+        self.assertEqual(self.get_summary().findtext('total'), '3')
+        RoadEvent.objects.filter(id='3').delete()
+        summary = self.get_summary()
+        self.assertEqual(summary.findtext('total'), '2')
+        self.assertEqual(self.counts(summary, 'severity'), [('MAJOR', 2)])
+
+    def test_unknown_facet(self):
+        resp = self.client.get(reverse('open511_roadevent_summary'), {'facets': 'colour'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_post_not_allowed(self):
+        resp = self.client.post(reverse('open511_roadevent_summary'), '{}', content_type='application/json')
+        self.assertEqual(resp.status_code, 405)
+
+    def test_reserved_jurisdiction_ids(self):
+        with self.assertRaises(ValidationError):
+            Jurisdiction(id='summary').save()
@@ -0,0 +1,42 @@
+"""Fixtures shared by the test modules."""
+
+from xml.sax.saxutils import escape
+
+from open511_server.views.test_endpoint import execute_test_endpoint_command
+
+EVENT_XML = """<event>
+    <id>test.open511.org/%(id)s</id>
+    <status>ACTIVE</status>
+    <headline>%(headline)s</headline>
+    %(description)s
+    <event_type>%(event_type)s</event_type>
+    <severity>%(severity)s</severity>
+    <geography>
+        <gml:Point srsName="urn:ogc:def:crs:EPSG::4326"><gml:pos>%(pos)s</gml:pos></gml:Point>
+    </geography>
+    %(roads)s
+    <schedule><intervals><interval>2014-01-01T00:00/2099-01-01T00:00</interval></intervals></schedule>
+</event>"""
+
+
+def event_xml(id, headline=None, description=None, event_type='CONSTRUCTION', severity='MAJOR',
+        pos='45.5 -73.6', road=None):
+    """An active event in the test.open511.org jurisdiction, as XML; the
+    headline defaults to the ID."""
+    return EVENT_XML % {
+        'id': escape(id),
+        'headline': escape(headline or id),
+        'description': '<description>%s</description>' % escape(description) if description else '',
+        'event_type': event_type,
+        'severity': severity,
+        'pos': pos,
+        'roads': '<roads><road><name>%s</name></road></roads>' % escape(road) if road else '',
+    }
+
+
+def load_events(*events):
+    """Loads events through the test endpoint, each given as a dict of
+    event_xml arguments."""
+    execute_test_endpoint_command('load', xml=(
+        '<open511 xml:lang="en" xmlns:gml="http://www.opengis.net/gml" version="v1"><events>%s</events></open511>'
+        % ''.join(event_xml(**event) for event in events)))
@@ -1,17 +1,30 @@
 from django.conf.urls import url
 from open511_server.conf import settings
 
-from open511_server.views.events import RoadEventView, RoadEventListView
+from open511_server.views.events import (RoadEventView, RoadEventListView,
+    RoadEventActiveSetView, RoadEventBatchView, RoadEventRouteSearchView, RoadEventSummaryView)
 from open511_server.views.jurisdictions import JurisdictionView, JurisdictionGeographyView
 from open511_server.views.cameras import CameraView, CameraListView
+from open511_server.views.analytics import EventRollupView
 from open511_server.views.areas import AreaListView
+from open511_server.views.changes import ChangeListView, ChangeStreamView
 from open511_server.views.discovery import DiscoveryView
 from open511_server.views.test_endpoint import TestEndpointView
+from open511_server.views.tiles import RoadEventTileView, CameraTileView
+
+TILE_PATTERN = r'tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$'
 
 urlpatterns = [
+    url(r'^events/' + TILE_PATTERN, RoadEventTileView.as_view(), name='open511_roadevent_tile'),
+    url(r'^cameras/' + TILE_PATTERN, CameraTileView.as_view(), name='open511_camera_tile'),
     url(r'^events/$', RoadEventListView.as_view(), name='open511_roadevent_list'),
+    url(r'^events/routes/$', RoadEventRouteSearchView.as_view(), name='open511_roadevent_routes'),
+    url(r'^events/summary/$', RoadEventSummaryView.as_view(), name='open511_roadevent_summary'),
+    url(r'^events/batch/$', RoadEventBatchView.as_view(), name='open511_roadevent_batch'),
     url(r'^events/(?P<jurisdiction_id>[a-z0-9.-]+)/$', RoadEventListView.as_view(),
         name='open511_roadevent_list'),
+    url(r'^events/(?P<jurisdiction_id>[a-z0-9.-]+)/active_set/$', RoadEventActiveSetView.as_view(),
+        name='open511_roadevent_active_set'),
     url(r'^events/(?P<jurisdiction_id>[a-z0-9.-]+)/(?P<id>[^/]+)/$', RoadEventView.as_view(),
         name='open511_roadevent'),
     #url(r'^jurisdictions/$', 'jurisdictions.list_jurisdictions'),
@@ -20,6 +33,9 @@ urlpatterns = [
     url(r'^jurisdictions/(?P<id>[a-z0-9.-]+)/geography/$', JurisdictionGeographyView.as_view(),
         name='open511_jurisdiction_geography'),
     url(r'^areas/$', AreaListView.as_view(), name="open511_area_list"),
+    url(r'^analytics/events/$', EventRollupView.as_view(), name="open511_event_rollups"),
+    url(r'^changes/$', ChangeListView.as_view(), name="open511_change_list"),
+    url(r'^changes/stream/$', ChangeStreamView.as_view(), name="open511_change_stream"),
     url(r'^cameras/$', CameraListView.as_view(), name="open511_camera_list"),
     url(r'^cameras/(?P<jurisdiction_id>[a-z0-9.-]+)/(?P<id>[^/]+)/$', CameraView.as_view(),
         name="open511_camera"),
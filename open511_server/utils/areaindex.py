@@ -0,0 +1,154 @@
+"""An in-memory spatial index of auto-label Areas, so that labelling events
+with the areas they fall within doesn't need a database query per event.
+
+The index is an STR-packed R-tree over the areas' bounding boxes, with a
+prepared geometry for the exact test. It's rebuilt after an Area is saved
+or deleted in this process, and other processes notice changes within
+STALE_CHECK_SECONDS."""
+
+from copy import deepcopy
+import math
+import threading
+import time
+
+from django.db.models import Count, Max
+
+from lxml.builder import E
+
+
+class _Node(object):
+
+    __slots__ = ['extent', 'children', 'entry']
+
+    def __init__(self, extent, children=None, entry=None):
+        self.extent = extent
+        self.children = children
+        self.entry = entry
+
+
+class _Entry(object):
+
+    __slots__ = ['area_id', 'prepared', 'xml_elem', 'order']
+
+    def __init__(self, area, order):
+        self.area_id = area.id
+        self.prepared = area.geom.prepared
+        self.xml_elem = area.xml_elem
+        self.order = order
+
+
+def _overlaps(a, b):
+    return not (a[2] < b[0] or a[0] > b[2] or a[3] < b[1] or a[1] > b[3])
+
+
+def _union(extents):
+    return (
+        min(e[0] for e in extents),
+        min(e[1] for e in extents),
+        max(e[2] for e in extents),
+        max(e[3] for e in extents)
+    )
+
+
+def _center(node, axis):
+    return node.extent[axis] + node.extent[axis + 2]
+
+
+class AreaIndex(object):
+
+    NODE_CAPACITY = 10
+
+    def __init__(self, areas):
+        nodes = [_Node(area.geom.extent, entry=_Entry(area, i))
+            for i, area in enumerate(areas) if area.geom]
+        while len(nodes) > self.NODE_CAPACITY:
+            nodes = self._pack(nodes)
+        self.root = nodes
+
+    def _pack(self, nodes):
+        """Sort-Tile-Recursive packing of one level of the tree: tiles the nodes
+        into vertical slices by x, then groups each slice by y."""
+        capacity = self.NODE_CAPACITY
+        num_parents = int(math.ceil(len(nodes) / float(capacity)))
+        slice_size = int(math.ceil(math.sqrt(num_parents))) * capacity
+        nodes = sorted(nodes, key=lambda n: _center(n, 0))
+        parents = []
+        for i in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[i:i + slice_size], key=lambda n: _center(n, 1))
+            for j in range(0, len(vertical_slice), capacity):
+                children = vertical_slice[j:j + capacity]
+                parents.append(_Node(_union([c.extent for c in children]), children=children))
+        return parents
+
+    def intersecting(self, geom):
+        """Returns the index entries for areas intersecting a GEOS geometry,
+        in the order the areas were given."""
+        extent = geom.extent
+        stack = list(self.root)
+        result = []
+        while stack:
+            node = stack.pop()
+            if not _overlaps(node.extent, extent):
+                continue
+            if node.entry is None:
+                stack.extend(node.children)
+            elif node.entry.prepared.intersects(geom):
+                result.append(node.entry)
+        return sorted(result, key=lambda entry: entry.order)
+
+    def label(self, rdev):
+        """Adds any matching areas that aren't already there to a RoadEvent's XML."""
+        matches = self.intersecting(rdev.geom)
+        if not matches:
+            return
+        existing = set(rdev.xml_elem.xpath('areas/area/id/text()'))
+        try:
+            areas_el = rdev.xml_elem.xpath('areas')[0]
+        except IndexError:
+            areas_el = None
+        for entry in matches:
+            if entry.area_id in existing:
+                continue
+            if areas_el is None:
+                areas_el = E.areas()
+                rdev.xml_elem.append(areas_el)
+            areas_el.append(deepcopy(entry.xml_elem))
+
+    def label_events(self, events):
+        for rdev in events:
+            self.label(rdev)
+
+
+STALE_CHECK_SECONDS = 60
+
+_index = None
+_index_state = None
+_index_checked = 0
+_lock = threading.Lock()
+
+
+def _areas_state():
+    from open511_server.models import Area
+    state = Area.objects.aggregate(count=Count('internal_id'), updated=Max('updated'))
+    return (state['count'], state['updated'])
+
+
+def get_area_index():
+    """Returns the AreaIndex of auto-label areas, rebuilding it if areas have changed."""
+    global _index, _index_state, _index_checked
+    from open511_server.models import Area
+    with _lock:
+        if _index is not None and time.time() - _index_checked < STALE_CHECK_SECONDS:
+            return _index
+        state = _areas_state()
+        _index_checked = time.time()
+        if _index is None or state != _index_state:
+            _index = AreaIndex(list(Area.objects.filter(auto_label=True).order_by('internal_id')))
+            _index_state = state
+        return _index
+
+
+def invalidate_area_index(**kwargs):
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,202 @@
+"""Fans out new EventChanges to the clients of the change stream.
+
+Each process has one ChangeBroadcaster. When changes are recorded -- anywhere,
+via Postgres NOTIFY, or in this process, via the event_changes_recorded signal --
+it reads the new rows once and puts each one on the queue of every matching
+subscriber. Waiting on a queue is cheap under gevent, so a worker can hold
+open a great many idle stream connections."""
+
+from collections import namedtuple
+import logging
+import select
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from django.db import close_old_connections, connection
+
+import psycopg2
+
+from open511_server.conf import settings
+from open511_server.models import EventChange, event_changes_recorded
+
+logger = logging.getLogger(__name__)
+
+StreamedChange = namedtuple('StreamedChange', 'sequence full_id change_type published created bounds')
+
+_CHANGES_SQL = """SELECT c.sequence, c.full_id, c.change_type, c.published, c.created,
+        ST_XMin(e.geom::geometry), ST_YMin(e.geom::geometry),
+        ST_XMax(e.geom::geometry), ST_YMax(e.geom::geometry)
+    FROM open511_eventchange c
+    LEFT JOIN open511_jurisdiction jur ON jur.id = split_part(c.full_id, '/', 1)
+    LEFT JOIN open511_roadevent e ON e.jurisdiction_id = jur.internal_id
+        AND e.id = substr(c.full_id, length(jur.id) + 2)
+    WHERE c.sequence > %s
+    ORDER BY c.sequence
+    LIMIT %s"""
+
+
+def fetch_changes(since, limit=1000):
+    """Returns up to limit StreamedChanges with sequence numbers after since."""
+    with connection.cursor() as cursor:
+        cursor.execute(_CHANGES_SQL, [since, limit])
+        return [
+            StreamedChange(*(row[:5] + ((row[5:] if row[5] is not None else None),)))
+            for row in cursor.fetchall()
+        ]
+
+
+class Subscriber(object):
+    """One client of the change stream, and the changes waiting for it."""
+
+    MAX_QUEUED = 1000
+
+    def __init__(self, jurisdictions=None, bbox=None, include_unpublished=False):
+        self.jurisdictions = set(jurisdictions) if jurisdictions else None
+        self.bbox = bbox
+        self.include_unpublished = include_unpublished
+        self.queue = queue.Queue(maxsize=self.MAX_QUEUED)
+        self.overflowed = False
+
+    def matches(self, change):
+        if not (change.published or self.include_unpublished):
+            return False
+        if self.jurisdictions and change.full_id.split('/', 1)[0] not in self.jurisdictions:
+            return False
+        if self.bbox and change.bounds:
+            # Deleted events have no bounds, so their tombstones always match
+            xmin, ymin, xmax, ymax = change.bounds
+            if (xmax < self.bbox[0] or xmin > self.bbox[2]
+                    or ymax < self.bbox[1] or ymin > self.bbox[3]):
+                return False
+        return True
+
+    def put(self, change):
+        try:
+            self.queue.put_nowait(change)
+        except queue.Full:
+            # A client that's this far behind should reconnect and catch up
+            # from the change log.
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Returns the next change, or None if none arrives within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChangeBroadcaster(object):
+
+    RECONNECT_DELAY = 5
+    # Check for changes this often even if we haven't been told about any,
+    # in case a notification was missed
+    POLL_INTERVAL = 60
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last_sequence = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def subscribe(self, subscriber):
+        self.start()
+        with self._lock:
+            self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def wake(self, **kwargs):
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.last_sequence = EventChange.latest_sequence()
+        self._spawn(self._dispatch_loop)
+        if settings.OPEN511_CHANGE_STREAM_BACKEND == 'listen':
+            self._spawn(self._listen_loop)
+        else:
+            event_changes_recorded.connect(self.wake, sender=EventChange, weak=False)
+
+    def _spawn(self, target):
+        # With gevent's monkey-patching, these are greenlets
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception:
+                logger.exception("Error dispatching event changes")
+            finally:
+                close_old_connections()
+
+    def dispatch(self):
+        """Sends changes since the last dispatch to matching subscribers.
+
+        Sequence numbers are only given out as changes commit, in commit
+        order, so nothing can later appear at or below last_sequence."""
+        # In case a writer died between committing and numbering its changes
+        EventChange.assign_sequences()
+        while True:
+            changes = fetch_changes(self.last_sequence)
+            if not changes:
+                return
+            with self._lock:
+                subscribers = list(self.subscribers)
+            for change in changes:
+                for subscriber in subscribers:
+                    if subscriber.matches(change):
+                        subscriber.put(change)
+            self.last_sequence = changes[-1].sequence
+
+    def _listen_loop(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Lost LISTEN connection for event changes")
+            # Catch up on anything we missed while disconnected
+            self.wake()
+            time.sleep(self.RECONNECT_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(**connection.get_connection_params())
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute('LISTEN %s' % EventChange.NOTIFY_CHANNEL)
+            while True:
+                if select.select([conn], [], [], self.POLL_INTERVAL) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    # One wakeup handles any number of notifications
+                    del conn.notifies[:]
+                    self.wake()
+        finally:
+            conn.close()
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = ChangeBroadcaster()
+    return _broadcaster
@@ -0,0 +1,50 @@
+from lxml import etree
+
+from open511.converter import geom_to_xml_element
+from open511.utils.serialization import GML_NS
+
+# Simplification levels offered via the simplify= parameter, and their
+# tolerances in degrees
+SIMPLIFY_TOLERANCES = [
+    ('low', 0.01),
+    ('medium', 0.001),
+    ('high', 0.0001),
+]
+SIMPLIFY_LEVELS = frozenset(level for level, _ in SIMPLIFY_TOLERANCES)
+
+
+def simplified_variants(geom):
+    """Given a GEOS geometry, returns a dict of simplification level -> GML string,
+    to be stored alongside the full geometry."""
+    if geom is None:
+        return {}
+    variants = {}
+    for level, tolerance in SIMPLIFY_TOLERANCES:
+        simple = geom.simplify(tolerance, preserve_topology=True)
+        if simple.empty:
+            simple = geom
+        simple.srid = geom.srid
+        variants[level] = etree.tostring(geom_to_xml_element(simple), encoding='unicode')
+    return variants
+
+
+def round_gml_coordinates(gml, precision):
+    """Rounds every coordinate in an lxml GML element, in place, to the given number of decimal places."""
+    for el in gml.iter('{%s}pos' % GML_NS, '{%s}posList' % GML_NS, '{%s}coordinates' % GML_NS):
+        el.text = ' '.join(
+            ','.join(repr(round(float(n), precision)) for n in pair.split(','))
+            for pair in el.text.split()
+        )
+
+
+def apply_geometry_options(geography_el, variants, level=None, precision=None):
+    """Given a <geography> element, swaps in the pre-rendered GML for the
+    given simplification level, and rounds coordinates to the given precision."""
+    if level and level in variants:
+        for child in list(geography_el):
+            geography_el.remove(child)
+        geography_el.append(etree.fromstring(variants[level]))
+    if precision is not None:
+        for child in geography_el:
+            round_gml_coordinates(child, precision)
+    return geography_el
@@ -28,6 +28,8 @@ def accept_from_request(request, default=DEFAULT_ACCEPT):
             return MIMEAccept('application/xml')
         elif get_format == 'json':
             return MIMEAccept('application/json')
+        elif get_format == 'geojson':
+            return MIMEAccept('application/geo+json')
         return MIMEAccept(get_format)
 
     if 'HTTP_ACCEPT' in request.META:
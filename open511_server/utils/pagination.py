@@ -1,5 +1,9 @@
-from django.conf import settings
+import json
 
+from django.db import connections
+from django.db.models.query import QuerySet
+
+from open511_server.conf import settings
 from open511_server.utils.exceptions import BadRequest
 
 class APIPaginator(object):
@@ -109,6 +113,27 @@ class APIPaginator(object):
             encoded_params
         )
 
+    def get_total(self):
+        """
+        Returns a tuple of (total number of objects, whether that's an estimate).
+
+        For querysets, it's an exact count unless the query planner estimates
+        more than ``OPEN511_EXACT_COUNT_THRESHOLD`` rows, in which case it's that estimate.
+        """
+        if not isinstance(self.objects, QuerySet):
+            return len(self.objects), False
+        qs = self.objects.order_by()
+        sql, params = qs.query.sql_with_params()
+        cursor = connections[qs.db].cursor()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate > settings.OPEN511_EXACT_COUNT_THRESHOLD:
+            return estimate, True
+        return qs.count(), False
+
     def page(self):
         """
         Returns a tuple of (objects, page_data), where objects is one page of objects (a list),
@@ -134,4 +159,11 @@ class APIPaginator(object):
         page_data['previous_url'] = (self._generate_uri(limit, offset - limit)
             if offset > 0 else None)
 
+        if self.request_data.get('include_total') in ('1', 'true'):
+            if page_data['next_url'] is None and (objects or offset == 0):
+                # This is the last page, so we know the total without a query
+                page_data['total'], page_data['total_is_estimate'] = offset + len(objects), False
+            else:
+                page_data['total'], page_data['total_is_estimate'] = self.get_total()
+
         return (objects, page_data)
\ No newline at end of file
@@ -6,6 +6,9 @@ except NameError:
 from django.db import connection, transaction
 from django.db.utils import DatabaseError
 
+# Half the circumference of the earth in Web Mercator (EPSG:3857) units
+MERCATOR_MAX = 20037508.342789244
+
 
 @transaction.atomic
 def _convert_gml(gml_string, output_func, force_2D=True):
@@ -0,0 +1,116 @@
+"""
+Batch evaluation of event schedules.
+
+Each event's schedule is compiled into arrays of interval start and end times
+(as UTC timestamps), so that questions like "which of these events are in
+effect at time t?" can be answered for thousands of events in one NumPy call.
+Compiled schedules are cached in memory, keyed on the event's pk and updated time.
+"""
+import calendar
+from collections import OrderedDict
+import datetime
+import threading
+
+import numpy as np
+
+# Recurring schedules can go on forever, so they're compiled for a window
+# around the current date. Queries outside the window trigger a recompile.
+COMPILE_DAYS_BEFORE = 7
+COMPILE_DAYS_AFTER = 90
+
+MAX_CACHED_SCHEDULES = 20000
+# Least recently used first
+_compiled_schedules = OrderedDict()
+_lock = threading.Lock()
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple()) if dt.tzinfo else calendar.timegm(dt.timetuple())
+
+
+class CompiledSchedule(object):
+    """The intervals of a single schedule between window_start and window_end,
+    as arrays of timestamps. Open-ended intervals end at infinity."""
+
+    def __init__(self, schedule, window_start, window_end):
+        if schedule.root.xpath('intervals'):
+            # An explicit list of intervals; compile all of them
+            window_start = datetime.datetime(1900, 1, 1)
+            window_end = datetime.datetime(2200, 1, 1)
+        periods = list(schedule.intervals(window_start, window_end))
+        self.window_start = _timestamp(schedule.to_timezone(window_start))
+        self.window_end = _timestamp(schedule.to_timezone(window_end))
+        self.starts = np.array([_timestamp(p.start) for p in periods], dtype=float)
+        self.ends = np.array([_timestamp(p.end) if p.end else np.inf for p in periods], dtype=float)
+
+    def covers(self, start_ts, end_ts):
+        return self.window_start <= start_ts and self.window_end >= end_ts
+
+
+def compile_schedule(rdev, range_start, range_end):
+    """Returns a CompiledSchedule for the RoadEvent covering at least range_start to range_end,
+    from the cache if possible."""
+    key = (rdev.pk, rdev.updated)
+    if rdev.pk:
+        with _lock:
+            cached = _compiled_schedules.pop(key, None)
+            if cached:
+                _compiled_schedules[key] = cached
+        if cached and cached.covers(_timestamp(range_start), _timestamp(range_end)):
+            return cached
+
+    today = datetime.datetime.now(range_start.tzinfo)
+    compiled = CompiledSchedule(rdev.schedule,
+        min(range_start, today - datetime.timedelta(days=COMPILE_DAYS_BEFORE)),
+        max(range_end, today + datetime.timedelta(days=COMPILE_DAYS_AFTER)))
+    if rdev.pk:
+        with _lock:
+            _compiled_schedules[key] = compiled
+            while len(_compiled_schedules) > MAX_CACHED_SCHEDULES:
+                _compiled_schedules.popitem(last=False)
+    return compiled
+
+
+def has_remaining_periods(rdev, now):
+    """Does the RoadEvent's schedule have any time left after now? Uses
+    the compiled schedule, so the admin's event list doesn't parse every
+    event's schedule on every page view."""
+    compiled = compile_schedule(rdev, now, now)
+    if (compiled.ends >= _timestamp(now)).any():
+        return True
+    if rdev.schedule.root.xpath('intervals'):
+        # Every interval was compiled, and they're all over
+        return False
+    # Recurring schedules are only compiled for a window; look past it
+    return rdev.schedule.has_remaining_intervals()
+
+
+class ScheduleBatch(object):
+    """The schedules of many RoadEvents, queryable all at once.
+
+    range_start and range_end (timezone-aware datetimes) are the span of time
+    that queries will be about."""
+
+    def __init__(self, events, range_start, range_end):
+        self.events = list(events)
+        compiled = [compile_schedule(rdev, range_start, range_end) for rdev in self.events]
+        self.owners = np.repeat(np.arange(len(compiled)), [len(c.starts) for c in compiled])
+        self.starts = np.concatenate([c.starts for c in compiled] + [np.empty(0)])
+        self.ends = np.concatenate([c.ends for c in compiled] + [np.empty(0)])
+
+    def active_within_range(self, query_start, query_end):
+        """Returns a boolean array saying whether each event is ever active between
+        query_start and query_end."""
+        hits = (self.starts <= _timestamp(query_end)) & (self.ends >= _timestamp(query_start))
+        result = np.zeros(len(self.events), dtype=bool)
+        result[self.owners[hits]] = True
+        return result
+
+    def includes(self, query):
+        """Returns a boolean array saying whether each event is active at the given time."""
+        return self.active_within_range(query, query)
+
+    def filter_active_within_range(self, query_start, query_end):
+        """Returns a list of the events active at some point between query_start and query_end."""
+        mask = self.active_within_range(query_start, query_end)
+        return [rdev for rdev, active in zip(self.events, mask) if active]
@@ -0,0 +1,37 @@
+"""Text search over road events, using the GIN expression indexes from
+migration 0016: full-text over the headline, description, road names and
+area names, each parsed in its own language, plus fuzzy trigram matching
+of road names."""
+
+from open511_server.conf import settings
+
+
+def search_events(qs, q, rank=True):
+    """Filters a QuerySet of RoadEvents to those matching the words in q.
+    If rank is true, orders them best match first."""
+    q = q.strip()
+    if not q:
+        return qs
+    table = qs.model._meta.db_table
+    vector = 'open511_event_search_vector({0}.xml_data)'.format(table)
+    road_names = 'open511_event_road_names({0}.xml_data)'.format(table)
+
+    # The words are stemmed for each language we expect; '' is the simple
+    # configuration, used for text in any other language.
+    languages = list(settings.OPEN511_SEARCH_LANGUAGES) + ['']
+    query = '(' + ' || '.join(['plainto_tsquery(open511_search_config(%s), %s)'] * len(languages)) + ')'
+    query_params = [param for lang in languages for param in (lang, q)]
+
+    qs = qs.extra(
+        where=['({vector} @@ {query} OR %s <%% {road_names})'.format(
+            vector=vector, query=query, road_names=road_names)],
+        params=query_params + [q]
+    )
+    if rank:
+        qs = qs.extra(
+            select={'search_rank': 'ts_rank({vector}, {query}) + word_similarity(%s, {road_names})'.format(
+                vector=vector, query=query, road_names=road_names)},
+            select_params=query_params + [q],
+            order_by=['-search_rank']
+        )
+    return qs
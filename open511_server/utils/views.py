@@ -9,6 +9,7 @@ import time
 
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest
+from django.http.response import HttpResponseBase
 from django.shortcuts import render
 from django.template.defaultfilters import escape
 from django.utils.cache import patch_vary_headers
@@ -24,6 +25,7 @@ from open511.utils.serialization import get_base_open511_element, make_link
 
 from open511_server.utils.exceptions import BadRequest
 from open511_server.utils.auth import can
+from open511_server.utils.geometry import SIMPLIFY_LEVELS, apply_geometry_options, simplified_variants
 from open511_server.utils.http import accept_from_request, accept_language_from_request
 from open511_server.utils.pagination import APIPaginator
 
@@ -52,6 +54,13 @@ class APIView(View):
             return request.META['HTTP_OPEN511_VERSION']
         return self.potential_versions[0]
 
+    def determine_selected_fields(self, request):
+        """Returns the set of element names (with link rels for links)
+        requested with fields=, or None to return everything."""
+        if not request.GET.get('fields'):
+            return None
+        return frozenset(json_link_key_to_xml_rel(key) for key in request.GET['fields'].split(','))
+
     def determine_accept_language(self, request):
         if request.response_format == 'application/xml':
             # If we're outputting XML, don't prune languages by default
@@ -84,13 +93,14 @@ class APIView(View):
             request.pretty_print = True
 
         request.accept_language = self.determine_accept_language(request)
+        request.selected_fields = self.determine_selected_fields(request)
 
         try:
             result = super(APIView, self).dispatch(request, *args, **kwargs)
         except BadRequest as e:
             return HttpResponseBadRequest(unicode(e))
 
-        if isinstance(result, HttpResponse):
+        if isinstance(result, HttpResponseBase):
             return result
 
         self.remove_unselected_fields(request, result)
@@ -102,6 +112,9 @@ class APIView(View):
         else:
             resp = HttpResponse('This API can only return data in XML or JSON.', status=406)
 
+        if resp.status_code == 200:
+            resp.status_code = result.status
+
         if request.html_response:
             resp = self.render_api_browser(request, resp.content)
 
@@ -117,12 +130,41 @@ class APIView(View):
 
         return resp
 
+    def get_geometry_options(self, request):
+        """Returns a (simplification level, coordinate precision) tuple from the
+        simplify and geometry_precision parameters; either can be None."""
+        level = request.GET.get('simplify') or None
+        if level and level not in SIMPLIFY_LEVELS:
+            raise BadRequest("simplify must be one of: %s" % ', '.join(sorted(SIMPLIFY_LEVELS)))
+        precision = request.GET.get('geometry_precision')
+        if precision:
+            try:
+                precision = int(precision)
+                assert 0 <= precision <= 15
+            except (ValueError, AssertionError):
+                raise BadRequest("geometry_precision must be a number of decimal places between 0 and 15")
+        else:
+            precision = None
+        return level, precision
+
+    def apply_geometry_options(self, request, obj, el):
+        """Simplifies and rounds the <geography> in an object's XML as requested."""
+        level, precision = self.get_geometry_options(request)
+        if level is None and precision is None:
+            return el
+        geography_el = el if el.tag == 'geography' else el.find('geography')
+        if geography_el is not None:
+            variants = obj.simplified_geography or simplified_variants(obj.geom)
+            apply_geometry_options(geography_el, variants, level, precision)
+        return el
+
     def get_xml_doc(self, request, result):
         base = get_base_open511_element(base=settings.OPEN511_BASE_URL)
         if isinstance(result.resource, (list, tuple)):
             base.extend(result.resource)
         else:
             base.append(result.resource)
+        base.extend(getattr(result, 'extra', ()))
         if getattr(result, 'pagination', None):
             base.append(result.pagination_to_xml())
         metadata = self.get_response_metadata(request)
@@ -133,10 +175,10 @@ class APIView(View):
         return base
 
     def remove_unselected_fields(self, request, result):
-        if not request.GET.get('fields'):
+        fields = request.selected_fields
+        if not fields:
             return
 
-        fields = frozenset(json_link_key_to_xml_rel(key) for key in request.GET['fields'].split(','))
         def _remove_children(el):
             for child in el:
                 tagname = child.tag
@@ -195,7 +237,7 @@ class APIView(View):
             ctx['get_params'] += [['accept-language', unicode(request.accept_language)]]
 
         ctx['available_filters'] = [k for k in
-            ['version', 'limit', 'fields'] + list(getattr(self, 'filters', {}).keys())
+            ['version', 'limit', 'fields', 'simplify', 'geometry_precision'] + list(getattr(self, 'filters', {}).keys())
             if k not in request.GET
         ]
 
@@ -242,12 +284,9 @@ class ModelListAPIView(APIView):
     def get(self, request, **kwargs):
         qs = self.get_qs(request, **kwargs)
 
-        for filter_name, value in request.GET.items():
-            if self.filters.get(filter_name):
-                try:
-                    qs = self.filters[filter_name](qs, value)
-                except ValueError as e:
-                    raise BadRequest(u"Error in filter {}: {}".format(filter_name, e))
+        qs = self.apply_filters(request, qs)
+
+        qs = self.project(request, qs)
 
         objects = self.post_filter(request, qs)
 
@@ -261,15 +300,34 @@ class ModelListAPIView(APIView):
 
         return Resource(el, pagination)
 
+    def apply_filters(self, request, qs, exclude=(), params=None):
+        """Applies the filters in params (by default, the querystring) to the QuerySet."""
+        if params is None:
+            params = request.GET
+        for filter_name, value in params.items():
+            if self.filters.get(filter_name) and filter_name not in exclude:
+                try:
+                    qs = self.filters[filter_name](qs, value)
+                except ValueError as e:
+                    raise BadRequest(u"Error in filter {}: {}".format(filter_name, e))
+        return qs
+
+    def project(self, request, qs):
+        """Limits the QuerySet to the columns needed to render the selected fields."""
+        return qs
+
     def post_filter(self, request, qs):
         return qs
 
 
 class Resource(object):
 
-    def __init__(self, resource, pagination=None):
+    def __init__(self, resource, pagination=None, status=200, extra=()):
         self.resource = resource
         self.pagination = pagination
+        self.status = status
+        # Further elements to include in the response, alongside the resource
+        self.extra = extra
 
     def pagination_to_xml(self):
         if not self.pagination:
@@ -277,6 +335,10 @@ class Resource(object):
         el = E.pagination(
             E.offset(unicode(self.pagination['offset'])),
         )
+        if 'total' in self.pagination:
+            el.append(E.total(unicode(self.pagination['total'])))
+            if self.pagination['total_is_estimate']:
+                el.append(E.total_is_estimate('true'))
         for linkname in ['previous_url', 'next_url']:
             url = self.pagination.get(linkname)
             if url:
@@ -4,16 +4,26 @@ except NameError:
     unicode = str
     from functools import reduce
 
+import json
 import operator
 
-from django.contrib.gis.geos import Polygon
-from django.contrib.gis.measure import Distance
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.geos import Point
+from django.db import connection
 from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 
 import dateutil.parser
+from lxml.builder import E
 
-from open511_server.models import Jurisdiction, SearchGeometry
+from open511.converter import geom_to_xml_element
+
+from open511_server.models import Jurisdiction, SearchGeometry, SearchGeometryPiece
+from open511_server.utils.exceptions import BadRequest
+from open511_server.utils.pagination import APIPaginator
+from open511_server.utils.postgis import MERCATOR_MAX
 from open511_server.utils.views import APIView, ModelListAPIView, Resource
 
 class CommonFilters(object):
@@ -31,10 +41,13 @@ class CommonFilters(object):
         )
 
     @staticmethod
-    def db(fieldname, qs, value, allow_operators=False):
+    def db(fieldname, qs, value, allow_operators=False, allow_list=False):
         if allow_operators:
             op, value = _parse_operator_from_value(value)
             fieldname = fieldname + '__' + op
+        elif allow_list and ',' in value:
+            fieldname = fieldname + '__in'
+            value = value.split(',')
         return qs.filter(**{fieldname: value})
 
     @staticmethod
@@ -47,16 +60,38 @@ class CommonFilters(object):
 
     @staticmethod
     def bbox(qs, value, fieldname='geom'):
+        # Uses a planar && against the (geom::geometry) expression index, which is
+        # much cheaper than a geography intersects; for anything but points,
+        # that's followed by an exact ST_Intersects on the candidates.
         coords = [float(n) for n in value.split(',')]
-        assert len(coords) == 4
-        return qs.filter(**{fieldname + '__intersects': Polygon.from_bbox(coords)})
+        if len(coords) != 4:
+            raise ValueError("bbox must be four comma-separated numbers")
+        field = qs.model._meta.get_field(fieldname)
+        column = '{0}.{1}::geometry'.format(qs.model._meta.db_table, field.column)
+        envelope = 'ST_MakeEnvelope(%s, %s, %s, %s, 4326)'
+        where = ['{0} && {1}'.format(column, envelope)]
+        params = coords
+        if not isinstance(field, PointField):
+            where.append('ST_Intersects({0}, {1})'.format(column, envelope))
+            params = coords * 2
+        return qs.extra(where=where, params=params)
 
     @staticmethod
     def geography(qs, value, within=None):
+        # Join against the subdivided pieces of the search geometry, rather
+        # than testing against one potentially enormous polygon
         search_geom = SearchGeometry.fromstring(value)
         if within is not None:
-            return qs.filter(geom__dwithin=(search_geom.geom, Distance(m=within)))
-        return qs.filter(geom__intersects=search_geom.geom)
+            predicate = 'ST_DWithin(p.geom, {0}.geom, %s)'
+            params = [search_geom.id, float(within)]
+        else:
+            predicate = 'ST_Intersects(p.geom, {0}.geom)'
+            params = [search_geom.id]
+        return qs.extra(
+            where=[('EXISTS (SELECT 1 FROM {1} p WHERE p.search_geometry_id = %s AND '
+                + predicate + ')').format(qs.model._meta.db_table, SearchGeometryPiece._meta.db_table)],
+            params=params
+        )
 
     @staticmethod
     def jurisdiction(qs, value):
@@ -82,16 +117,180 @@ def _parse_operator_from_value(value):
             return query_type, value[len(op):]
     return 'exact', value
 
+def xml_text_sql(xpath):
+    """An SQL expression for the first text matching an XPath in the xml_data
+    of a table aliased as t."""
+    return "(xpath('%s', t.xml_data))[1]::text" % xpath
+
+# With cluster=grid, the size of a grid cell in pixels at the requested zoom level
+CLUSTER_GRID_PIXELS = 64
+# The highest zoom level cluster=grid accepts
+CLUSTER_MAX_ZOOM = 30
+
 class CommonListView(ModelListAPIView):
 
+    potential_content_types = ModelListAPIView.potential_content_types | set(['application/geo+json'])
+
+    # The small set of properties, as (name, SQL expression on the model's table aliased as t)
+    # pairs, included in format=geojson output and vector tiles.
+    sql_properties = []
+
+    # Querystring parameters that post_filter deals with using each object's XML,
+    # which then can't be deferred
+    xml_filters = ()
+
+    # An SQL expression, on the model's table aliased as t, whose values are counted
+    # within each cluster; and the name of the element to return those counts in.
+    cluster_breakdown = None
+    cluster_breakdown_name = None
+
+    def get(self, request, **kwargs):
+        if 'cluster' in request.GET:
+            return self.get_clusters(request, **kwargs)
+        if request.response_format == 'application/geo+json':
+            return self.get_geojson(request, **kwargs)
+        return super(CommonListView, self).get(request, **kwargs)
+
+    def get_geojson(self, request, **kwargs):
+        """Returns a page of results as a GeoJSON FeatureCollection, built entirely
+        by PostgreSQL from the geometry column and sql_properties."""
+        objects = self.post_filter(request, self.apply_filters(request, self.get_qs(request, **kwargs)))
+        if isinstance(objects, QuerySet):
+            objects = objects.only('internal_id')
+        ids, pagination = APIPaginator(request, objects).page()
+        ids = [o.internal_id for o in ids]
+
+        sql = """
+            SELECT json_build_object(
+                'type', 'FeatureCollection',
+                'features', coalesce(json_agg(f.feature ORDER BY f.position), '[]'::json),
+                'pagination', %s::json
+            )::text FROM (
+                SELECT array_position(%s::integer[], t.internal_id) AS position,
+                    json_build_object(
+                        'type', 'Feature',
+                        'id', jur.id || '/' || t.id,
+                        'geometry', ST_AsGeoJSON(t.geom)::json,
+                        'properties', json_build_object({properties})
+                    ) AS feature
+                FROM {table} t
+                JOIN open511_jurisdiction jur ON jur.internal_id = t.jurisdiction_id
+                WHERE t.internal_id = ANY(%s::integer[])
+            ) f
+        """.format(
+            properties=', '.join("'%s', %s" % prop for prop in self.sql_properties),
+            table=self.model._meta.db_table
+        )
+        cursor = connection.cursor()
+        cursor.execute(sql, [json.dumps(pagination), ids, ids])
+
+        resp = HttpResponse(cursor.fetchone()[0], content_type='application/geo+json')
+        resp['Access-Control-Allow-Origin'] = '*'
+        return resp
+
+    def get_clusters(self, request, **kwargs):
+        """Instead of individual objects, returns clusters of the objects matching the filters,
+        each with a centroid, a count, and counts of cluster_breakdown values.
+
+        cluster=grid&zoom=Z groups objects into grid cells of about 64 pixels
+        at web map zoom level Z; cluster=dbscan&distance=M groups objects within
+        (approximately, using Web Mercator) M metres of each other."""
+        qs = self.apply_filters(request, self.get_qs(request, **kwargs))
+        qs = self.post_filter(request, qs)
+        if not isinstance(qs, QuerySet):
+            raise BadRequest("Clustering can't be combined with the filters provided.")
+
+        try:
+            if request.GET['cluster'] == 'grid':
+                zoom = int(request.GET['zoom'])
+                if not 0 <= zoom <= CLUSTER_MAX_ZOOM:
+                    raise ValueError
+                cell_size = (2 * MERCATOR_MAX / (2 ** zoom)) / 256 * CLUSTER_GRID_PIXELS
+                cluster_key = "ST_AsText(ST_SnapToGrid(ST_Transform(pt, 3857), %s))"
+                cluster_params = [cell_size]
+            elif request.GET['cluster'] == 'dbscan':
+                distance = float(request.GET['distance'])
+                # Also rules out NaN
+                if not 0 < distance < float('inf'):
+                    raise ValueError
+                cluster_key = "ST_ClusterDBSCAN(ST_Transform(pt, 3857), eps := %s, minpoints := 1) OVER ()"
+                cluster_params = [distance]
+            else:
+                raise BadRequest("cluster must be grid or dbscan")
+        except (KeyError, ValueError):
+            raise BadRequest("cluster=grid requires an integer zoom from 0 to %s, and cluster=dbscan "
+                "a positive distance in metres" % CLUSTER_MAX_ZOOM)
+
+        ids_sql, ids_params = qs.order_by().values('internal_id').query.sql_with_params()
+        sql = """
+            WITH points AS (
+                SELECT ST_Centroid(t.geom::geometry) AS pt, {breakdown} AS breakdown
+                FROM {table} t WHERE t.internal_id IN ({ids_sql})
+            ), keyed AS (
+                SELECT pt, breakdown, {cluster_key} AS cluster_key FROM points
+            ), by_breakdown AS (
+                SELECT cluster_key, breakdown, count(*) AS n, avg(ST_X(pt)) AS x, avg(ST_Y(pt)) AS y
+                FROM keyed GROUP BY cluster_key, breakdown
+            )
+            SELECT sum(n), sum(x * n) / sum(n), sum(y * n) / sum(n),
+                json_object_agg(coalesce(breakdown, ''), n)
+            FROM by_breakdown GROUP BY cluster_key ORDER BY sum(n) DESC
+        """.format(
+            breakdown=self.cluster_breakdown or 'NULL::text',
+            table=qs.model._meta.db_table,
+            ids_sql=ids_sql,
+            cluster_key=cluster_key
+        )
+        cursor = connection.cursor()
+        cursor.execute(sql, list(ids_params) + cluster_params)
+
+        clusters = E.clusters()
+        for count, x, y, breakdown in cursor.fetchall():
+            cluster = E.cluster(
+                E.count(unicode(int(count))),
+                E.geography(geom_to_xml_element(Point(x, y, srid=4326)))
+            )
+            if self.cluster_breakdown:
+                if isinstance(breakdown, (str, unicode)):
+                    breakdown = json.loads(breakdown)
+                name = self.cluster_breakdown_name
+                cluster.append(E(name + '_counts', *[
+                    E(name + '_count', E(name, value), E.count(unicode(n)))
+                    for value, n in sorted(breakdown.items()) if value
+                ]))
+            clusters.append(cluster)
+        return Resource(clusters)
+
     def post_filter(self, request, qs):
         objects = super(CommonListView, self).post_filter(request, qs)
         if 'geography' in request.GET and 'geography' in self.filters:
             objects = CommonFilters.geography(objects, request.GET['geography'],
                 within=request.GET.get('tolerance'))
+        if 'near' in request.GET and 'near' in self.filters:
+            objects = self.order_by_distance(objects, request.GET['near'])
 
         return objects
 
+    def order_by_distance(self, qs, value):
+        """Orders by distance from a lon,lat point, nearest first, using the <->
+        operator so that PostGIS walks the spatial index. Each object gets
+        a distance attribute, in metres."""
+        try:
+            lon, lat = [float(n) for n in value.split(',')]
+        except ValueError:
+            raise BadRequest("near must be in the form longitude,latitude")
+        return qs.extra(
+            select={'distance': '{0}.geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography'.format(
+                qs.model._meta.db_table)},
+            select_params=[lon, lat],
+            order_by=['distance']
+        )
+
+    def add_distance(self, obj, el):
+        if getattr(obj, 'distance', None) is not None:
+            el.append(E.distance('%.1f' % obj.distance))
+        return el
+
     def get_qs(self, request, jurisdiction_id=None):
         qs = self.model._default_manager.all()
         if jurisdiction_id:
@@ -99,7 +298,22 @@ class CommonListView(ModelListAPIView):
             qs = qs.filter(jurisdiction=jur)
         return qs
 
+    def project(self, request, qs):
+        fields = request.selected_fields
+        if fields is None:
+            return qs
+        model_fields = set(f.name for f in self.model._meta.get_fields())
+        defer = []
+        if fields <= self.model.COLUMN_FIELDS and not any(p in request.GET for p in self.xml_filters):
+            defer.append('xml_data')
+        if 'geography' not in fields:
+            defer += ['geom', 'simplified_geography']
+        elif not (request.GET.get('simplify') or request.GET.get('geometry_precision')):
+            defer.append('simplified_geography')
+        return qs.defer(*[f for f in defer if f in model_fields])
+
     def object_to_xml(self, request, obj):
-        return obj.to_full_xml_element(
+        return self.add_distance(obj, obj.to_full_xml_element(
             accept_language=request.accept_language,
-        )
+            fields=request.selected_fields,
+        ))
@@ -0,0 +1,116 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+import datetime
+
+from django.db import connection
+from django.utils.translation import ugettext_lazy as _
+
+import dateutil.parser
+from lxml.builder import E
+import pytz
+
+from open511_server.models import EventRollup, _now
+from open511_server.utils.exceptions import BadRequest
+from open511_server.utils.views import APIView, Resource
+
+
+class EventRollupView(APIView):
+    """Historical counts of events started and ended, from the hourly rollups.
+
+    start and end (ISO 8601; by default, the last 7 days) bound the report;
+    interval is hour, day, week or month, in the given timezone (default UTC).
+    group_by is a comma-separated list of jurisdiction, area, event_type and
+    severity; jurisdiction, area, event_type and severity also filter.
+
+    The rollups are as current as the last run of the update_rollups command."""
+
+    resource_name = _('event rollups')
+
+    filters = {
+        'start': None,
+        'end': None,
+        'interval': None,
+        'timezone': None,
+        'group_by': None,
+        'jurisdiction': None,
+        'area': None,
+        'event_type': None,
+        'severity': None,
+    }
+
+    INTERVALS = ('hour', 'day', 'week', 'month')
+    # name -> EventRollup column
+    DIMENSIONS = [
+        ('jurisdiction', 'jurisdiction'),
+        ('area', 'area_id'),
+        ('event_type', 'event_type'),
+        ('severity', 'severity'),
+    ]
+    MAX_HOURLY_RANGE = datetime.timedelta(days=62)
+
+    def get(self, request):
+        try:
+            end = dateutil.parser.parse(request.GET['end']) if request.GET.get('end') else _now()
+            start = (dateutil.parser.parse(request.GET['start']) if request.GET.get('start')
+                else end - datetime.timedelta(days=7))
+        except ValueError:
+            raise BadRequest("start and end must be ISO 8601 datetimes")
+        for dt in (start, end):
+            if not dt.tzinfo:
+                raise BadRequest("start and end must include a timezone offset")
+
+        interval = request.GET.get('interval', 'day')
+        if interval not in self.INTERVALS:
+            raise BadRequest("interval must be one of %s" % ', '.join(self.INTERVALS))
+        if interval == 'hour' and end - start > self.MAX_HOURLY_RANGE:
+            raise BadRequest("Hourly reports can cover at most %s days" % self.MAX_HOURLY_RANGE.days)
+
+        tz = request.GET.get('timezone', 'UTC')
+        if tz not in pytz.all_timezones_set:
+            raise BadRequest("Unknown timezone %s" % tz)
+
+        dimensions = dict(self.DIMENSIONS)
+        group_by = [d for d in request.GET.get('group_by', '').split(',') if d]
+        unknown = set(group_by) - set(dimensions)
+        if unknown:
+            raise BadRequest("Can't group by %s" % ', '.join(sorted(unknown)))
+        group_by = [name for name, column in self.DIMENSIONS if name in group_by]
+
+        where = ['bucket >= %s', 'bucket < %s']
+        params = [start, end]
+        for name, column in self.DIMENSIONS:
+            if request.GET.get(name):
+                where.append(column + ' = ANY(%s)')
+                params.append(request.GET[name].split(','))
+        if 'area' in group_by or request.GET.get('area'):
+            where.append("area_id <> %s")
+        else:
+            where.append("area_id = %s")
+        params.append(EventRollup.ALL_AREAS)
+
+        columns = [dimensions[name] for name in group_by]
+        sql = """SELECT date_trunc(%s, bucket AT TIME ZONE %s) AT TIME ZONE %s AS period,
+                {columns} sum(started), sum(ended)
+            FROM open511_eventrollup
+            WHERE {where}
+            GROUP BY {group_by}
+            ORDER BY {group_by}""".format(
+            columns=''.join(c + ', ' for c in columns),
+            where=' AND '.join(where),
+            group_by=', '.join(['1'] + [str(i + 2) for i in range(len(columns))])
+        )
+        cursor = connection.cursor()
+        cursor.execute(sql, [interval, tz, tz] + params)
+
+        rollups = E.rollups()
+        for row in cursor.fetchall():
+            rollup = E.rollup(E.period_start(row[0].isoformat()))
+            for name, value in zip(group_by, row[1:-2]):
+                rollup.append(E(name, value))
+            rollup.append(E.events_started(unicode(row[-2])))
+            rollup.append(E.events_ended(unicode(row[-1])))
+            rollups.append(rollup)
+        return Resource(rollups)
@@ -1,4 +1,9 @@
+from lxml.builder import E
+
+from open511.converter import geom_to_xml_element
+
 from open511_server.models import Area
+from open511_server.utils.geometry import apply_geometry_options
 from open511_server.utils.views import ModelListAPIView
 
 
@@ -8,10 +13,21 @@ class AreaListView(ModelListAPIView):
     model = Area
     resource_name_plural = 'areas'
 
-    base_qs = Area.objects.defer('geom')
-
     def get_qs(self, request):
-        return self.base_qs.all()
+        level, precision = self.get_geometry_options(request)
+        if level:
+            return Area.objects.defer('geom')
+        elif precision is not None:
+            return Area.objects.defer('simplified_geography')
+        return Area.objects.defer('geom', 'simplified_geography')
 
     def object_to_xml(self, request, obj):
-        return obj.remove_unnecessary_languages(request.accept_language)
+        el = obj.remove_unnecessary_languages(request.accept_language)
+        level, precision = self.get_geometry_options(request)
+        # Area geometries are only included when asked for with simplify or geometry_precision
+        if level and (obj.simplified_geography or obj.geom):
+            el.append(self.apply_geometry_options(request, obj, E.geography()))
+        elif precision is not None and obj.geom:
+            el.append(apply_geometry_options(E.geography(geom_to_xml_element(obj.geom)), {},
+                precision=precision))
+        return el
@@ -6,7 +6,7 @@ from lxml.builder import E
 
 from open511_server.models import Camera
 from open511_server.utils.views import APIView, Resource
-from open511_server.views import CommonFilters, CommonListView
+from open511_server.views import CommonFilters, CommonListView, xml_text_sql
 
 class CameraListView(CommonListView):
 
@@ -22,8 +22,16 @@ class CameraListView(CommonListView):
         'area_name': partial(CommonFilters.xpath, 'areas/area/name/text()'),
         'geography': None,  # dealt with in post_filter
         'tolerance': None,  # dealt with in post_filter
+        'near': None,  # dealt with in post_filter
+        'cluster': None,  # dealt with in get_clusters
+        'zoom': None,
+        'distance': None,
     }
 
+    sql_properties = [
+        ('name', xml_text_sql('name/text()')),
+    ]
+
 class CameraView(APIView):
 
     model = Camera
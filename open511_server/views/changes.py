@@ -0,0 +1,187 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+import json
+
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+
+from lxml.builder import E
+
+from open511.utils.serialization import make_link
+
+from open511_server.conf import settings
+from open511_server.models import EventChange
+from open511_server.utils.auth import can
+from open511_server.utils.changestream import fetch_changes, get_broadcaster, Subscriber
+from open511_server.utils.exceptions import BadRequest
+from open511_server.utils.views import APIView, Resource
+
+
+class ChangeListView(APIView):
+    """The change log for road events, in order.
+
+    since=<sequence> returns only changes after that sequence number;
+    clients should follow the next link, which advances it. A DELETED change
+    is a tombstone for an event that no longer exists.
+
+    wait=<seconds> makes this a long poll: if there are no changes yet, the
+    response is held until one arrives or the time is up."""
+
+    model = EventChange
+    resource_name = _('changes')
+
+    filters = {
+        'since': None,
+        'jurisdiction': None,
+        'wait': None,
+    }
+
+    DEFAULT_LIMIT = 500
+    MAX_LIMIT = 5000
+    MAX_WAIT = 60
+
+    def get_changes(self, request, since, limit):
+        qs = EventChange.objects.filter(sequence__gt=since)
+        if not can(request, 'view_internal'):
+            qs = qs.filter(published=True)
+        if request.GET.get('jurisdiction'):
+            qs = qs.filter(full_id__startswith=request.GET['jurisdiction'] + '/')
+        return list(qs.order_by('sequence')[:limit])
+
+    def get(self, request):
+        try:
+            since = int(request.GET.get('since', 0))
+            limit = min(int(request.GET.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+            wait = min(float(request.GET.get('wait', 0)), self.MAX_WAIT)
+        except ValueError:
+            raise BadRequest("since, limit and wait must be numbers")
+        if limit < 1:
+            raise BadRequest("limit must be a positive integer")
+
+        changes = self.get_changes(request, since, limit)
+        if not changes and wait > 0:
+            broadcaster = get_broadcaster()
+            subscriber = Subscriber(
+                jurisdictions=[request.GET['jurisdiction']] if request.GET.get('jurisdiction') else None,
+                include_unpublished=can(request, 'view_internal'))
+            broadcaster.subscribe(subscriber)
+            try:
+                # Check again, in case something arrived before we subscribed
+                changes = self.get_changes(request, since, limit)
+                if not changes:
+                    # Don't hold a database connection while we wait
+                    connection.close()
+                    if subscriber.get(timeout=wait):
+                        changes = self.get_changes(request, since, limit)
+            finally:
+                broadcaster.unsubscribe(subscriber)
+
+        result = [E.changes(*[
+            E.change(
+                E.sequence(unicode(change.sequence)),
+                E.event_id(change.full_id),
+                E.change_type(change.change_type),
+                E.timestamp(change.created.isoformat())
+            ) for change in changes
+        ])]
+
+        params = request.GET.copy()
+        params['since'] = changes[-1].sequence if changes else since
+        pagination = E.pagination(make_link('next', request.path + '?' + params.urlencode()))
+        if len(changes) < limit:
+            # We're caught up; the next link is where to poll from later
+            pagination.append(E.caught_up('true'))
+        result.append(pagination)
+        return Resource(result)
+
+
+class ChangeStreamView(APIView):
+    """Pushes road event changes as they happen, as Server-Sent Events.
+
+    Accepts jurisdiction (comma-separated) and bbox filters. Reconnecting
+    clients send Last-Event-ID (or since=<sequence>) and are first sent
+    what they missed. Clients that can't use SSE should long-poll the
+    change list with wait= instead."""
+
+    potential_content_types = APIView.potential_content_types | set(['text/event-stream'])
+
+    # How many changes to read from the log at a time when catching up
+    BACKLOG_PAGE_SIZE = 1000
+
+    def get(self, request):
+        since = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('since')
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            raise BadRequest("since must be an integer")
+
+        bbox = None
+        if request.GET.get('bbox'):
+            try:
+                bbox = [float(n) for n in request.GET['bbox'].split(',')]
+                assert len(bbox) == 4
+            except (ValueError, AssertionError):
+                raise BadRequest("bbox must be xmin,ymin,xmax,ymax")
+
+        subscriber = Subscriber(
+            jurisdictions=request.GET['jurisdiction'].split(',') if request.GET.get('jurisdiction') else None,
+            bbox=bbox,
+            include_unpublished=can(request, 'view_internal'))
+        resp = StreamingHttpResponse(self.stream(subscriber, since), content_type='text/event-stream')
+        resp['Cache-Control'] = 'no-cache'
+        # Tell nginx not to buffer the stream
+        resp['X-Accel-Buffering'] = 'no'
+        if 'HTTP_ORIGIN' in request.META:
+            resp['Access-Control-Allow-Origin'] = '*'
+        return resp
+
+    def stream(self, subscriber, since):
+        broadcaster = get_broadcaster()
+        # Subscribe before reading the backlog, so nothing falls between the two
+        broadcaster.subscribe(subscriber)
+        try:
+            yield 'retry: 5000\n\n'
+            last_sent = since
+            if since is not None:
+                while True:
+                    page = fetch_changes(since, limit=self.BACKLOG_PAGE_SIZE)
+                    if not page:
+                        break
+                    for change in page:
+                        if subscriber.matches(change):
+                            yield self.format_event(change)
+                            last_sent = change.sequence
+                    # Move past every change read, matching or not, so a page
+                    # of other subscribers' changes doesn't end the backlog
+                    since = page[-1].sequence
+            # Don't hold a database connection for the life of the stream
+            connection.close()
+            while not subscriber.overflowed:
+                change = subscriber.get(timeout=settings.OPEN511_CHANGE_STREAM_KEEPALIVE)
+                if change is None:
+                    yield ': keepalive\n\n'
+                elif last_sent is None or change.sequence > last_sent:
+                    # Changes are numbered in commit order, so anything at or
+                    # below last_sent was already in the backlog
+                    yield self.format_event(change)
+                    last_sent = change.sequence
+            # The client has fallen too far behind; it'll reconnect with
+            # Last-Event-ID and catch up from the log.
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    def format_event(self, change):
+        return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+            change.sequence,
+            change.change_type.lower(),
+            json.dumps({
+                'sequence': change.sequence,
+                'event_id': change.full_id,
+                'change_type': change.change_type,
+                'timestamp': change.created.isoformat(),
+            })
+        )
@@ -1,11 +1,12 @@
 from django.core import urlresolvers
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
 
 from lxml.builder import E
 
 from open511.utils.serialization import make_link
 
-from open511_server.models import Jurisdiction, Camera, Area
+from open511_server.models import Jurisdiction, Camera, Area, DISCOVERY_CACHE_KEY
 from open511_server.utils.views import APIView, Resource
 
 # This should eventually be turned into an autodiscovery of some kind
@@ -27,6 +28,21 @@ SERVICES = [
     }
 ]
 
+# Saving or deleting an area or camera clears the cached services, but only
+# in caches that process can reach: with a per-process cache like the default
+# LocMemCache, other processes keep theirs until it expires. Use a shared
+# cache (e.g. memcached) for changes to show up everywhere at once.
+CACHE_SECONDS = 60
+
+def available_services():
+    """Returns the SERVICES whose tests pass. The result is cached for
+    CACHE_SECONDS, or until areas or cameras are saved or deleted."""
+    type_urls = cache.get(DISCOVERY_CACHE_KEY)
+    if type_urls is None:
+        type_urls = [s['type_url'] for s in SERVICES if 'test' not in s or s['test']()]
+        cache.set(DISCOVERY_CACHE_KEY, type_urls, CACHE_SECONDS)
+    return [s for s in SERVICES if s['type_url'] in type_urls]
+
 class DiscoveryView(APIView):
 
     include_up_link = False
@@ -45,7 +61,7 @@ class DiscoveryView(APIView):
                 #E.service_description(s['description']),
                 make_link('self', urlresolvers.reverse(s['url_name'])),
                 make_link('service_type', s['type_url'])
-            ) for s in SERVICES if 'test' not in s or s['test']()
+            ) for s in available_services()
         ])
 
         return Resource([jurisdictions, services])
@@ -1,20 +1,36 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+from collections import OrderedDict
 import datetime
 from functools import partial
+import hashlib
 import json
 
-from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.contrib.gis.geos import GEOSException, fromstr as geos_geom_from_string
+from django.db import connection, DatabaseError, transaction
+from django.db.models.query import QuerySet
 from django.http import HttpResponse, HttpResponseRedirect, Http404, HttpResponseNotAllowed
 from django.shortcuts import get_object_or_404
 
 import dateutil.parser
 from lxml.builder import E
+from open511.utils.serialization import make_link
 from pytz import utc
 
-from open511_server.models import RoadEvent, Jurisdiction, SearchGeometry
+from open511_server.models import EventChange, RoadEvent, Jurisdiction, SearchGeometry
+from open511_server.subscriptions import match_subscriptions_on_commit
+from open511_server.utils.areaindex import get_area_index
 from open511_server.utils.auth import can
 from open511_server.utils.exceptions import BadRequest
+from open511_server.utils.schedule import ScheduleBatch
+from open511_server.utils.search import search_events
 from open511_server.utils.views import APIView, ModelListAPIView, Resource
-from open511_server.views import CommonFilters, CommonListView
+from open511_server.views import CommonFilters, CommonListView, xml_text_sql
 
 
 def filter_status(qs, value):
@@ -46,21 +62,85 @@ class RoadEventListView(CommonListView):
         'event_subtype': partial(CommonFilters.xpath, 'event_subtypes/event_subtype/text()'),
         'road_name': partial(CommonFilters.xpath, 'roads/road/name/text()'),
         'impacted_system': partial(CommonFilters.xpath, 'roads/road/impacted_systems/impacted_system/text()'),
-        'id': partial(CommonFilters.db, 'id'),
+        'id': partial(CommonFilters.db, 'id', allow_list=True),
         'area': partial(CommonFilters.xpath, 'areas/area/id/text()'),
         'area_name': partial(CommonFilters.xpath, 'areas/area/name/text()'),
+        'q': search_events,
         'geography': None,  # dealt with in post_filter
         'tolerance': None,  # dealth with in post_filter
+        'near': None,  # dealt with in post_filter
         'in_effect_on': None,  # dealt with in post_filter
+        'ids': None,  # dealt with in get_by_ids
+        'cluster': None,  # dealt with in get_clusters
+        'zoom': None,
+        'distance': None,
     }
 
+    xml_filters = ('in_effect_on',)
+
+    cluster_breakdown = xml_text_sql('severity/text()')
+    cluster_breakdown_name = 'severity'
+
+    sql_properties = [
+        ('status', "CASE WHEN t.active THEN 'ACTIVE' ELSE 'ARCHIVED' END"),
+        ('severity', xml_text_sql('severity/text()')),
+        ('event_type', xml_text_sql('event_type/text()')),
+        ('headline', xml_text_sql('headline/text()')),
+    ]
+
+    # The most events that can be fetched at once with ids=
+    MAX_IDS = 500
+
+    def get(self, request, **kwargs):
+        if 'ids' in request.GET:
+            return self.get_by_ids(request, **kwargs)
+        return super(RoadEventListView, self).get(request, **kwargs)
+
+    def get_by_ids(self, request, jurisdiction_id=None):
+        """Returns the events with the comma-separated full IDs in ids=, active or
+        not, in the order given, found with one lookup on the (jurisdiction, id)
+        index. IDs that don't match a visible event are listed in <missing_ids>."""
+        full_ids = list(OrderedDict.fromkeys(
+            jurisdiction_id + '/' + full_id if jurisdiction_id and '/' not in full_id else full_id
+            for full_id in request.GET['ids'].split(',') if full_id
+        ))
+        if len(full_ids) > self.MAX_IDS:
+            raise BadRequest("ids= can include at most %s IDs" % self.MAX_IDS)
+        pairs = [tuple(full_id.partition('/')[::2]) for full_id in full_ids]
+        if not all(jur_id and event_id for jur_id, event_id in pairs):
+            raise BadRequest("ids= should be a comma-separated list of full event IDs, "
+                "like jurisdiction.example.org/123")
+
+        jurisdictions = Jurisdiction.objects.filter(id__in=set(jur_id for jur_id, event_id in pairs))
+        if jurisdiction_id:
+            jurisdictions = jurisdictions.filter(id=jurisdiction_id)
+        internal_ids = dict(jurisdictions.values_list('id', 'internal_id'))
+        lookups = [(internal_ids[jur_id], event_id) for jur_id, event_id in pairs if jur_id in internal_ids]
+
+        found = {}
+        if lookups:
+            qs = RoadEvent.objects.all()
+            if not can(request, 'view_internal'):
+                qs = qs.filter(published=True)
+            qs = qs.extra(
+                where=["(open511_roadevent.jurisdiction_id, open511_roadevent.id) IN "
+                    "(SELECT * FROM unnest(%s::integer[], %s::text[]))"],
+                params=[[lookup[0] for lookup in lookups], [lookup[1] for lookup in lookups]]
+            )
+            found = dict((rdev.full_id, rdev) for rdev in self.project(request, qs))
+
+        return Resource(
+            E(self.resource_name_plural,
+                *[self.object_to_xml(request, found[full_id]) for full_id in full_ids if full_id in found]),
+            extra=[E.missing_ids(*[E.missing_id(full_id) for full_id in full_ids if full_id not in found])]
+        )
+
     def post_filter(self, request, qs):
         if request.GET.get('in_effect_on'):
             qs = qs.filter(active=True)
         objects = super(RoadEventListView, self).post_filter(request, qs)
 
         if 'in_effect_on' in request.GET:
-            # FIXME inefficient - implement on DB
             if request.GET['in_effect_on'] == 'now':
                 start, end = utc.localize(datetime.datetime.utcnow()), None
             else:
@@ -70,10 +150,13 @@ class RoadEventListView(CommonListView):
             if end:
                 if (end - start) > datetime.timedelta(days=40):
                     raise BadRequest("The in_effect_on filter can't handle ranges of more than 40 days.")
-                filter_func = lambda o: o.schedule.active_within_range(start, end)
             else:
-                filter_func = lambda o: o.schedule.includes(start)
-            objects = [o for o in objects if filter_func(o)]
+                end = start
+            if start.tzinfo and end.tzinfo:
+                objects = ScheduleBatch(objects, start, end).filter_active_within_range(start, end)
+            else:
+                # Naive times are interpreted in each event's own timezone
+                objects = [o for o in objects if o.schedule.active_within_range(start, end)]
         return objects
 
     def get_qs(self, request, jurisdiction_id=None):
@@ -89,10 +172,12 @@ class RoadEventListView(CommonListView):
         return qs
 
     def object_to_xml(self, request, obj):
-        return obj.to_full_xml_element(
+        el = obj.to_full_xml_element(
             accept_language=request.accept_language,
-            remove_internal_elements=not can(request, 'view_internal')
+            remove_internal_elements=not can(request, 'view_internal'),
+            fields=request.selected_fields
         )
+        return self.add_distance(obj, self.apply_geometry_options(request, obj, el))
 
     def post(self, request):
         content = json.loads(request.body.decode(
@@ -110,10 +195,117 @@ class RoadEventListView(CommonListView):
 
         rdev.auto_label_areas()
         rdev.save()
+        match_subscriptions_on_commit()
 
         return HttpResponseRedirect(rdev.get_absolute_url())
 
 
+class RoadEventSummaryView(RoadEventListView):
+    """Counts of the events matching the usual list filters, grouped by
+    severity, event type, jurisdiction and area, without rendering any events.
+
+    facets= limits the response to some of those. Each facet's counts are
+    cached, keyed on the filters and the latest change log sequence number;
+    sequence numbers are handed out in commit order, so any committed change
+    to events invalidates them."""
+
+    http_method_names = ['get', 'head']
+
+    # name -> SQL expression for an event's value; area's is an array of values
+    FACETS = OrderedDict([
+        ('severity', xml_text_sql('severity/text()')),
+        ('event_type', xml_text_sql('event_type/text()')),
+        ('jurisdiction', 'jur.id'),
+        ('area', "xpath('areas/area/id/text()', t.xml_data)::text[]"),
+    ])
+    MULTIVALUED_FACETS = frozenset(['area'])
+
+    CACHE_SECONDS = 3600
+
+    # Parameters that don't change which events are counted
+    IGNORED_PARAMS = frozenset(['limit', 'offset', 'format', 'fields', 'accept-language',
+        'indent', 'callback', 'version', 'facets'])
+
+    def get(self, request):
+        facets = request.GET.get('facets')
+        facets = facets.split(',') if facets else list(self.FACETS.keys())
+        unknown = set(facets) - set(self.FACETS.keys())
+        if unknown:
+            raise BadRequest("Unknown facets: %s. Available facets are %s" % (
+                ', '.join(sorted(unknown)), ', '.join(self.FACETS.keys())))
+
+        cache_prefix = None
+        if request.GET.get('in_effect_on') != 'now':
+            params = sorted((k, v) for k, v in request.GET.items() if k not in self.IGNORED_PARAMS)
+            cache_prefix = 'open511_summary_' + hashlib.md5(json.dumps([
+                params, can(request, 'view_internal'), EventChange.latest_sequence()
+            ]).encode('utf8')).hexdigest()
+
+        results = {}
+        if cache_prefix:
+            cached = cache.get_many([cache_prefix + facet for facet in ['total'] + facets])
+            results = dict((key[len(cache_prefix):], value) for key, value in cached.items())
+        missing = [facet for facet in ['total'] + facets if facet not in results]
+
+        if missing:
+            results.update(self.count_facets(request, missing))
+            if cache_prefix:
+                cache.set_many(dict((cache_prefix + facet, results[facet]) for facet in missing),
+                    self.CACHE_SECONDS)
+
+        summary = E.summary(E.total(unicode(results['total'])))
+        for facet in facets:
+            summary.append(E(facet + '_counts', *[
+                E(facet + '_count', E(facet, value), E.count(unicode(n)))
+                for value, n in results[facet]
+            ]))
+        return Resource(summary)
+
+    def count_facets(self, request, facets):
+        """Returns a dict of facet name -> list of (value, count), most common
+        first, for the given facets; 'total' is just the count.
+
+        The facet values are pulled out of each matching event's XML once, in a
+        single pass, and then grouped per facet."""
+        objects = self.post_filter(request, self.apply_filters(request, self.get_qs(request)))
+        if isinstance(objects, QuerySet):
+            ids_sql, ids_params = objects.order_by().values('internal_id').query.sql_with_params()
+            where, where_params = 't.internal_id IN (%s)' % ids_sql, list(ids_params)
+        else:
+            where, where_params = 't.internal_id = ANY(%s)', [[o.internal_id for o in objects]]
+
+        counts = []
+        for facet in facets:
+            if facet == 'total':
+                counts.append("SELECT 'total', NULL, count(*) FROM e")
+            elif facet in self.MULTIVALUED_FACETS:
+                counts.append("SELECT '{0}', v, count(*) FROM e CROSS JOIN LATERAL unnest(e.{0}) AS v "
+                    "GROUP BY 2".format(facet))
+            else:
+                counts.append("SELECT '{0}', {0}, count(*) FROM e WHERE {0} IS NOT NULL "
+                    "GROUP BY 2".format(facet))
+        sql = """WITH e AS (
+                SELECT t.internal_id{columns} FROM open511_roadevent t
+                JOIN open511_jurisdiction jur ON jur.internal_id = t.jurisdiction_id
+                WHERE {where}
+            ) {counts}""".format(
+            columns=''.join(', %s AS %s' % (self.FACETS[f], f) for f in facets if f in self.FACETS),
+            where=where,
+            counts=' UNION ALL '.join(counts)
+        )
+        results = dict((facet, []) for facet in facets)
+        cursor = connection.cursor()
+        cursor.execute(sql, where_params)
+        for facet, value, n in cursor.fetchall():
+            results[facet].append((value, n))
+        for facet in facets:
+            if facet == 'total':
+                results[facet] = results[facet][0][1]
+            else:
+                results[facet].sort(key=lambda row: (-row[1], row[0]))
+        return results
+
+
 class RoadEventView(APIView):
 
     model = RoadEvent
@@ -137,6 +329,7 @@ class RoadEventView(APIView):
 
         rdev.full_clean()
         rdev.save()
+        match_subscriptions_on_commit()
 
         return self.get(request, jurisdiction_id, id)
 
@@ -147,6 +340,7 @@ class RoadEventView(APIView):
             raise PermissionDenied
 
         rdev.delete()
+        match_subscriptions_on_commit()
 
         return HttpResponse(status=204)
 
@@ -158,7 +352,291 @@ class RoadEventView(APIView):
             rdev = base_qs.get(id=id)
         except RoadEvent.DoesNotExist:
             raise Http404
-        return Resource(E.events(rdev.to_full_xml_element(
+        el = rdev.to_full_xml_element(
             accept_language=request.accept_language,
-            remove_internal_elements=not can(request, 'view_internal')
-        )))
+            remove_internal_elements=not can(request, 'view_internal'),
+            fields=request.selected_fields
+        )
+        return Resource(E.events(self.apply_geometry_options(request, rdev, el)))
+
+
+class RoadEventBatchView(APIView):
+    """Creates, patches and deletes many events in one request.
+
+    POST a JSON object with a list of "operations", each one of
+        {"op": "create", "jurisdiction_id": "...", "data": {...}}
+        {"op": "patch", "id": "<jurisdiction_id>/<id>", "data": {...}}
+        {"op": "delete", "id": "<jurisdiction_id>/<id>"}
+    with data as for a single POST or PATCH. They're applied in one
+    transaction: if any operation fails, none are, and the response is a 400.
+    Either way, it has a result for each operation, in order."""
+
+    OPERATIONS = ('create', 'patch', 'delete')
+    MAX_OPERATIONS = 1000
+
+    # Errors in an operation that fail it, rather than the whole request
+    OPERATION_ERRORS = (BadRequest, PermissionDenied, ValidationError, ValueError, TypeError,
+        NotImplementedError, GEOSException, DatabaseError)
+
+    def post(self, request):
+        try:
+            content = json.loads(request.body.decode(
+                request.encoding if request.encoding else 'utf-8'))
+        except ValueError:
+            raise BadRequest("The request body isn't valid JSON")
+        operations = content.get('operations') if isinstance(content, dict) else None
+        if not (isinstance(operations, list) and operations
+                and all(isinstance(op, dict) for op in operations)):
+            raise BadRequest('Expected a JSON object with a list of "operations"')
+        if len(operations) > self.MAX_OPERATIONS:
+            raise BadRequest("A batch can have at most %s operations" % self.MAX_OPERATIONS)
+
+        # (jurisdiction ID, event ID) for each operation; event ID is None for creates
+        targets = [
+            (unicode(op.get('jurisdiction_id', '')), None) if op.get('op') == 'create'
+            else tuple(unicode(op.get('id', '')).partition('/')[::2])
+            for op in operations
+        ]
+        jurisdictions = dict((j.id, j) for j in Jurisdiction.objects.filter(
+            id__in=set(jurisdiction_id for jurisdiction_id, event_id in targets)))
+        editable = set(Jurisdiction.objects.filter(id__in=list(jurisdictions.keys()),
+            permitted_users__id=request.user.id).values_list('id', flat=True))
+
+        # [op, event, error message] for each operation
+        results = [[op.get('op'), None, None] for op in operations]
+        with transaction.atomic():
+            events = self._lock_events(jurisdictions, targets)
+            to_save = OrderedDict()  # id(event) -> result
+            to_delete = []
+            for op, (jurisdiction_id, event_id), result in zip(operations, targets, results):
+                try:
+                    rdev = self._apply(op, jurisdiction_id, event_id, jurisdictions, editable, events)
+                except self.OPERATION_ERRORS as e:
+                    result[2] = self._error_message(e)
+                    continue
+                result[1] = rdev
+                # If an event is patched twice, the last result reports any error
+                to_save.pop(id(rdev), None)
+                if op['op'] == 'delete':
+                    to_delete.append(rdev)
+                else:
+                    to_save[id(rdev)] = result
+
+            get_area_index().label_events(
+                [result[1] for result in to_save.values() if result[0] == 'create'])
+            for result in to_save.values():
+                try:
+                    result[1].full_clean(validate_unique=False)
+                except ValidationError as e:
+                    result[2] = self._error_message(e)
+
+            failed = any(error for op, rdev, error in results)
+            if failed:
+                transaction.set_rollback(True)
+            else:
+                RoadEvent.objects.save_batch([result[1] for result in to_save.values()])
+                if to_delete:
+                    RoadEvent.objects.filter(
+                        internal_id__in=[rdev.internal_id for rdev in to_delete]).delete()
+
+        if not failed:
+            match_subscriptions_on_commit()
+
+        results_el = E.results()
+        for index, (op, (jurisdiction_id, event_id), (op_name, rdev, error)) in enumerate(
+                zip(operations, targets, results)):
+            result_el = E.result(E.index(unicode(index)), E.op(unicode(op_name)))
+            if error:
+                result_el.append(E.status('error'))
+                result_el.append(E.error(error))
+            elif failed:
+                result_el.append(E.status('not_applied'))
+            else:
+                result_el.append(E.status(
+                    {'create': 'created', 'patch': 'updated', 'delete': 'deleted'}[op_name]))
+            if rdev is not None and (rdev.id or not failed):
+                result_el.append(E.id(rdev.full_id))
+                if not failed and op_name != 'delete':
+                    result_el.append(make_link('self', rdev.url))
+            elif event_id:
+                result_el.append(E.id(unicode(op.get('id'))))
+            results_el.append(result_el)
+        return Resource(results_el, status=400 if failed else 200)
+
+    def _lock_events(self, jurisdictions, targets):
+        """Fetches the existing events the operations refer to, locked until the
+        transaction ends, in a dict keyed by (jurisdiction ID, event ID)."""
+        event_ids = set(event_id for jurisdiction_id, event_id in targets if event_id)
+        if not event_ids:
+            return {}
+        by_internal_id = dict((j.internal_id, j) for j in jurisdictions.values())
+        events = {}
+        for rdev in RoadEvent.objects.select_for_update().filter(
+                jurisdiction__in=list(by_internal_id.keys()), id__in=list(event_ids)):
+            rdev.jurisdiction = by_internal_id[rdev.jurisdiction_id]
+            events[(rdev.jurisdiction.id, rdev.id)] = rdev
+        return events
+
+    def _apply(self, op, jurisdiction_id, event_id, jurisdictions, editable, events):
+        """Applies one operation to an event in memory, and returns the event."""
+        if op.get('op') not in self.OPERATIONS:
+            raise BadRequest("op must be one of: %s" % ', '.join(self.OPERATIONS))
+        if jurisdiction_id not in jurisdictions:
+            raise BadRequest("Unknown jurisdiction %s" % jurisdiction_id)
+        if jurisdiction_id not in editable:
+            raise PermissionDenied("You can't edit events in %s" % jurisdiction_id)
+
+        if op['op'] == 'create':
+            rdev = RoadEvent(jurisdiction=jurisdictions[jurisdiction_id])
+        else:
+            rdev = events.get((jurisdiction_id, event_id))
+            if rdev is None:
+                raise BadRequest("No event with ID %s" % op.get('id'))
+            if op['op'] == 'delete':
+                del events[(jurisdiction_id, event_id)]
+                return rdev
+
+        data = op.get('data') or {}
+        if not isinstance(data, dict):
+            raise BadRequest("data must be a JSON object")
+        # Converting geometries can hit the database, so an error mustn't
+        # abort the whole transaction
+        with transaction.atomic():
+            for key, val in data.items():
+                rdev.update(key, val)
+        return rdev
+
+    def _error_message(self, e):
+        if isinstance(e, ValidationError):
+            return '; '.join(e.messages)
+        return unicode(e) or e.__class__.__name__
+
+
+class RoadEventActiveSetView(APIView):
+    """A compact listing of the ID, content hash and update time of every
+    active event in a jurisdiction. Importers use it to find out which events
+    have disappeared or changed without downloading the full feed."""
+
+    model = RoadEvent
+
+    def get(self, request, jurisdiction_id):
+        jur = get_object_or_404(Jurisdiction, id=jurisdiction_id)
+        qs = RoadEvent.objects.filter(jurisdiction=jur, active=True)
+        if not can(request, 'view_internal'):
+            qs = qs.filter(published=True)
+        rows = qs.extra(
+            select={'content_hash': 'md5(xml_data::text)'}
+        ).order_by().values_list('id', 'content_hash', 'updated')
+        return Resource(E.events(*[
+            E.event(
+                E.id(u'/'.join((jur.id, id))),
+                E.hash(content_hash),
+                E.updated(updated.isoformat())
+            ) for id, content_hash, updated in rows
+        ]))
+
+
+class RoadEventRouteSearchView(APIView):
+    """Finds the events near many routes at once.
+
+    POST a JSON object like:
+    {
+        "routes": [{"name": "a", "geography": "LINESTRING(...)", "tolerance": 50}, ...],
+        "filters": {"severity": "MAJOR,MODERATE"},
+        "include_events": true
+    }
+
+    geography can be WKT or GeoJSON; tolerance is in metres; filters are the
+    same as for the events list. The response lists the matching event IDs for each
+    route. With include_events, each matching event is also included once."""
+
+    model = RoadEvent
+    unauthenticated_methods = APIView.unauthenticated_methods + ('POST',)
+
+    MAX_ROUTES = 100
+
+    def post(self, request):
+        try:
+            content = json.loads(request.body.decode(
+                request.encoding if request.encoding else 'utf-8'))
+            routes = content['routes']
+        except (ValueError, KeyError, TypeError):
+            raise BadRequest("The request body must be a JSON object with a list of routes")
+        if not isinstance(routes, list) or not all(isinstance(route, dict) for route in routes):
+            raise BadRequest("routes must be a list of JSON objects")
+        if not routes or len(routes) > self.MAX_ROUTES:
+            raise BadRequest("Provide between 1 and %s routes" % self.MAX_ROUTES)
+
+        filters = content.get('filters') or {}
+        if not isinstance(filters, dict) or not all(
+                isinstance(v, (unicode, str, int, float)) and not isinstance(v, bool) for v in filters.values()):
+            raise BadRequest("filters must be a JSON object of filter names to strings")
+        filters = dict((k, unicode(v)) for k, v in filters.items())
+
+        route_values = []
+        route_params = []
+        for route in routes:
+            geom = route.get('geography')
+            if isinstance(geom, dict):
+                geom = json.dumps(geom)
+            try:
+                geom = geos_geom_from_string(geom)
+                tolerance = float(route.get('tolerance', 0))
+            except (TypeError, ValueError, GEOSException):
+                raise BadRequest("Invalid geography or tolerance for route %s" % route.get('name'))
+            if tolerance < 0:
+                raise BadRequest("tolerance can't be negative, for route %s" % route.get('name'))
+            if not geom.srid:
+                geom.srid = 4326
+            route_values.append('(%s, ST_GeomFromEWKT(%s)::geography, %s)')
+            route_params.extend([unicode(route.get('name', len(route_params) // 3)), geom.ewkt, tolerance])
+
+        names = route_params[::3]
+        if len(set(names)) != len(names):
+            raise BadRequest("Route names must be unique")
+
+        qs = RoadEvent.objects.all()
+        if not can(request, 'view_internal'):
+            qs = qs.filter(published=True)
+        if 'status' not in filters:
+            qs = qs.filter(active=True)
+        list_view = RoadEventListView()
+        qs = list_view.apply_filters(request, qs, params=filters,
+            exclude=('geography', 'tolerance', 'in_effect_on', 'near'))
+        ids_sql, ids_params = qs.order_by().values('internal_id').query.sql_with_params()
+
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT r.name, e.internal_id
+            FROM (VALUES {values}) AS r(name, geom, tolerance)
+            CROSS JOIN LATERAL (
+                SELECT t.internal_id FROM {table} t
+                WHERE ST_DWithin(t.geom, r.geom, r.tolerance)
+                AND t.internal_id IN ({ids_sql})
+            ) e
+        """.format(
+            values=', '.join(route_values),
+            table=RoadEvent._meta.db_table,
+            ids_sql=ids_sql
+        ), route_params + list(ids_params))
+        matches = cursor.fetchall()
+
+        events = dict(
+            (rdev.internal_id, rdev) for rdev in
+            RoadEvent.objects.filter(internal_id__in=set(internal_id for _, internal_id in matches))
+        )
+        by_route = dict()
+        for name, internal_id in matches:
+            by_route.setdefault(name, []).append(events[internal_id].full_id)
+
+        result = [E.routes(*[
+            E.route(
+                E.name(name),
+                E.event_ids(*[E.event_id(full_id) for full_id in sorted(by_route.get(name, []))])
+            ) for name in names
+        ])]
+        if content.get('include_events'):
+            result.append(E.events(*[
+                list_view.object_to_xml(request, events[internal_id]) for internal_id in sorted(events)
+            ]))
+        return Resource(result)
@@ -34,4 +34,5 @@ class JurisdictionGeographyView(APIView):
 
     def get(self, request, id):
         jur_geo = get_object_or_404(JurisdictionGeography, jurisdiction__id=id)
-        return Resource(E.geographies(jur_geo.to_full_xml_element()))
+        return Resource(E.geographies(
+            self.apply_geometry_options(request, jur_geo, jur_geo.to_full_xml_element())))
@@ -0,0 +1,107 @@
+try:
+    unicode
+except NameError:
+    unicode = str
+
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.views.generic import View
+
+from open511_server.conf import settings
+from open511_server.utils.exceptions import BadRequest
+from open511_server.utils.postgis import MERCATOR_MAX
+from open511_server.views.cameras import CameraListView
+from open511_server.views.events import RoadEventListView
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+
+def tile_bounds(z, x, y):
+    """Returns the (xmin, ymin, xmax, ymax) Web Mercator bounds of a tile."""
+    size = 2 * MERCATOR_MAX / (2 ** z)
+    xmin = -MERCATOR_MAX + x * size
+    ymax = MERCATOR_MAX - y * size
+    return (xmin, ymax - size, xmin + size, ymax)
+
+
+class TileView(View):
+    """Serves Mapbox Vector Tiles, built by PostGIS, of the objects matching
+    the filters of a list view. Each tile has a single layer; each feature has
+    an id and the list view's small set of sql_properties."""
+
+    # Subclasses should set:
+    # list_view = a CommonListView subclass, whose get_qs, filters and sql_properties are used
+    # layer_name = 'events'
+
+    # Filters that make no sense for tiles
+    excluded_filters = ('bbox', 'geography', 'tolerance', 'in_effect_on')
+
+    def get(self, request, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if z > 30 or x >= 2 ** z or y >= 2 ** z:
+            return HttpResponseBadRequest("Invalid tile coordinates")
+
+        cache_key = 'open511_tile_' + hashlib.md5(
+            (request.path + '?' + request.GET.urlencode()).encode('utf8')).hexdigest()
+        can_cache = not request.user.is_authenticated()
+        tile = cache.get(cache_key) if can_cache else None
+
+        if tile is None:
+            list_view = self.list_view()
+            try:
+                qs = list_view.get_qs(request)
+                qs = list_view.apply_filters(request, qs, exclude=self.excluded_filters)
+            except BadRequest as e:
+                return HttpResponseBadRequest(unicode(e))
+            tile = self.render_tile(qs, tile_bounds(z, x, y))
+            if can_cache:
+                cache.set(cache_key, tile, settings.OPEN511_TILE_CACHE_SECONDS)
+
+        resp = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        resp['Access-Control-Allow-Origin'] = '*'
+        patch_cache_control(resp, max_age=settings.OPEN511_TILE_CACHE_SECONDS)
+        return resp
+
+    def render_tile(self, qs, bounds):
+        ids_sql, ids_params = qs.order_by().values('internal_id').query.sql_with_params()
+        table = qs.model._meta.db_table
+        sql = """
+            WITH bounds AS (SELECT ST_MakeEnvelope(%s, %s, %s, %s, 3857) AS geom)
+            SELECT ST_AsMVT(tile, %s, {extent}, 'geom') FROM (
+                SELECT {properties},
+                    ST_AsMVTGeom(ST_Transform(t.geom::geometry, 3857), bounds.geom,
+                        {extent}, {buffer}, true) AS geom
+                FROM {table} t
+                JOIN open511_jurisdiction jur ON jur.internal_id = t.jurisdiction_id,
+                bounds
+                WHERE t.geom && ST_Transform(bounds.geom, 4326)::geography
+                AND t.internal_id IN ({ids_sql})
+            ) AS tile WHERE tile.geom IS NOT NULL
+        """.format(
+            properties=', '.join('%s AS "%s"' % (expr, name) for name, expr in
+                [('id', "jur.id || '/' || t.id")] + self.list_view.sql_properties),
+            extent=TILE_EXTENT,
+            buffer=TILE_BUFFER,
+            table=table,
+            ids_sql=ids_sql
+        )
+        cursor = connection.cursor()
+        cursor.execute(sql, list(bounds) + [self.layer_name] + list(ids_params))
+        return bytes(cursor.fetchone()[0] or b'')
+
+
+class RoadEventTileView(TileView):
+
+    list_view = RoadEventListView
+    layer_name = 'events'
+
+
+class CameraTileView(TileView):
+
+    list_view = CameraListView
+    layer_name = 'cameras'
@@ -16,7 +16,8 @@ setup(
         'django-appconf==1.0.1',
         'cssselect==0.9.1',
         'Django>=1.11.8,<2',
-        'jsonfield==1.0.3'
+        'jsonfield==1.0.3',
+        'numpy'
     ],
     entry_points = {
         'console_scripts': [